@@ -1,11 +1,16 @@
-import pandas as pd
 import streamlit as st
-import altair as alt
 import pydeck as pdk
-import numpy as np
 import datetime
 from dateutil.relativedelta import relativedelta
 
+import dtl_charts
+import dtl_data
+import dtl_dataset
+import dtl_download
+import dtl_engine
+import dtl_trace
+import dtl_viewcache
+
 # Get the current date and time in format as "23 Mar 2023"
 # current_date = datetime.datetime.now().strftime("%d %b %Y")
 
@@ -18,30 +23,8 @@ st.set_page_config(
 
 st.markdown('<link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/bootstrap-icons@1.10.3/font/bootstrap-icons.css">', unsafe_allow_html=True)
 
-# Custom colour set based on https://flatuicolors.com/palette/defo
-colours = {
-    "Turquoise": "#1abc9c",  # greenish blue
-    "Emerald": "#2ecc71",  # bright green
-    "Peter River": "#3498db",  # light blueish
-    "Amethyst": "#9b59b6",  # purple
-    "Wet Asphalt": "#34495e",  # dark grayish blue
-    "Green Sea": "#16a085",  # blueish green
-    "Nephritis": "#27ae60",  # bright greenish blue
-    "Belize Hole": "#2980b9",  # darker blue than Peter River
-    "Wisteria": "#8e44ad",  # purplish blue
-    "Midnight Blue": "#2c3e50",  # dark blue
-    "Sun Flower": "#f1c40f",  # bright yellow
-    "Carrot": "#e67e22",  # orange
-    "Alizarin": "#e74c3c",  # dark red
-    "Clouds": "#ecf0f1",  # light gray
-    "Concrete": "#95a5a6",  # gray
-    "Orange": "#f39c12",  # orange
-    "Pumpkin": "#d35400",  # orangey red
-    "Pomegranate": "#c0392b",  # dark red
-    "Silver": "#bdc3c7",  # light grayish blue
-    "Asbestos": "#7f8c8d",  # dark gray
-    "Cornflower Blue": "#6495ED",
-}
+# Custom colour set lives with the charts
+colours = dtl_charts.colours
 
 # Making an icon, that should help to save some space in code.
 def bi_icon(name, size, colour):
@@ -51,28 +34,58 @@ def bi_icon(name, size, colour):
 DATA_URL = st.secrets["DATA_URL"]
 DATA_URL_PROJECTS = st.secrets["DATA_URL_PROJECTS"]
 
-# Loading data and caching it
-@st.cache_data
-def load_data():
-    data = pd.read_csv(DATA_URL, sep = ',', parse_dates = ["registration_date", "start_date","end_date"])
-    lowercase = lambda x: str(x).lower()
-    data.rename(lowercase, axis = 'columns', inplace = True)
-    
-    data = data.astype({'ecn': 'int64',
-                        'pid': 'int64', 
-                        'annual_amount': 'int64', 
-                        'contract_amount': 'int64', 
-                        'property_size': 'float64'
-                        })
-    return data
-
-@st.cache_data
-def load_projects():
-    projects = pd.read_csv(DATA_URL_PROJECTS, sep = ',', parse_dates = ["start_date", "completion_date"])
-    lowercase = lambda x: str(x).lower()
-    projects.rename(lowercase, axis = 'columns', inplace = True)
-
-    return projects
+# Loading data and caching it. Both come from the columnar snapshot (see dtl_data.py)
+# and fall back to parsing the CSV files only when the snapshot is missing or stale.
+SNAPSHOT_DIR = st.secrets.get("SNAPSHOT_DIR", dtl_data.SNAPSHOT_DIR)
+# The CSV files are streamed in chunks within this memory budget, optionally keeping only some areas
+INGEST_AREAS = st.secrets.get("INGEST_AREAS", None)
+INGEST_BUDGET = int(st.secrets.get("INGEST_BUDGET_MB", dtl_data.INGEST_BUDGET // 2**20)) * 2**20
+# Local CSV files are parsed by this many processes at once instead (see dtl_parallel.py)
+INGEST_WORKERS = st.secrets.get("INGEST_WORKERS", None)
+
+# Remote CSV files are downloaded once and kept on disk, then only revalidated (see dtl_download.py)
+DOWNLOAD_DIR = st.secrets.get("DOWNLOAD_DIR", dtl_download.DOWNLOAD_DIR)
+
+@st.cache_resource
+def load_downloads():
+    return dtl_download.DownloadCache(DOWNLOAD_DIR)
+
+downloads = load_downloads()
+
+# Span timings of every rerun, off unless DEBUG_TIMINGS is set in the secrets (see dtl_trace.py)
+@st.cache_resource
+def load_tracer():
+    return dtl_trace.Tracer(enabled = bool(st.secrets.get("DEBUG_TIMINGS", False)))
+
+tracer = load_tracer()
+tracer.begin_rerun()
+
+# One read-only dataset (contracts, projects, lookup indexes and building cube) per server process.
+# Unlike st.cache_data, st.cache_resource hands the same object to every session and rerun, no copies.
+# An ingest replaces it with the next one as a whole (see dtl_dataset.LiveDataset).
+@st.cache_resource
+def load_dataset():
+    tracer.miss("data_load")
+    # The last good copies are served while they're revalidated in the background,
+    # a newer file replaces the dataset on the next rerun
+    reload = lambda path: load_dataset.clear()
+    data_source = downloads.local(DATA_URL, reload)
+    projects_source = downloads.local(DATA_URL_PROJECTS, reload)
+    return dtl_dataset.LiveDataset(dtl_dataset.Dataset.load(data_source, projects_source, SNAPSHOT_DIR,
+                                                            INGEST_AREAS, INGEST_BUDGET, INGEST_WORKERS))
+
+# View models of the ECNs looked up and the chart specs of the page, shared by every session
+# and emptied when the dataset changes (see dtl_viewcache.py)
+@st.cache_resource
+def load_views():
+    return dtl_viewcache.ViewCache()
+
+views = load_views()
+
+# Rendering a chart from its cached spec, Altair only builds and validates it the first time
+def show_chart(key, chart):
+    spec = views.chart(dataset, key, lambda: dtl_charts.chart_spec(chart()))
+    st.vega_lite_chart(spec, use_container_width = True)
 
 # Adding a logo to the top left corner of the sidebar and hiding the menu and footer text
 def add_logo():
@@ -103,131 +116,58 @@ def add_logo():
         unsafe_allow_html=True,
     )
 
-# Drawing measure mean/median rule
-def rule_onchart(df, column, measure):
-    rule = alt.Chart(df).mark_rule(color = colours['Pomegranate'] if measure == 'median' else colours['Orange']).encode(
-        y = f"{measure}({column}):Q",
-        size = alt.value(2),
-        tooltip = [
-            alt.Tooltip(f"{measure}({column}):Q", title=f"{measure.capitalize()}", format = ',.0f')
-        ]
-    )
-    return rule
-
-# Drawing a bar chart with a median line and highlighting the active bar with a different colour
+# Drawing a bar chart with a median line and highlighting the active bar with a different colour.
+# Bars come from the precomputed building cube, one row per property size.
 def building_properties_size(building_name, size, usage):
-    df = data[(data['project'] == building_name) & (data['usage'] == usage)].copy()
-    df.reset_index(drop=True, inplace=True)
+    df, median, mean = dtl_engine.building_summary(dataset, building_name, usage)
 
-    median_str = '{:,.0f}'.format(np.median(df['annual_amount']))
-    mean_str = '{:,.0f}'.format(np.mean(df['annual_amount']))
+    median_str = '{:,.0f}'.format(median)
+    mean_str = '{:,.0f}'.format(mean)
 
     st.markdown(f"##### Property size for building/complex: {building_name}")
     st.caption(f" {bi_icon('square-fill', 1, colours['Pomegranate'])} Median {median_str} &nbsp;|&nbsp; {bi_icon('square-fill', 1, colours['Orange'])} Mean {mean_str}", unsafe_allow_html=True)
 
-    bar = alt.Chart(df).mark_bar().encode(
-        x = alt.X('property_size:O',
-                # bin=alt.Bin(extent=[df['property_size'].min(), df['property_size'].max()], step=10),
-                sort = 'ascending',
-                axis = alt.Axis(labelAngle = 0),
-                title = "Property size (sq.m)"
-                ),
-        y = alt.Y('median(annual_amount):Q', title = "Annual price [MEDIAN]"),
-        tooltip = [
-                    alt.Tooltip('median(annual_amount):Q', title = 'Median Annual amount', format = ',.0f'),
-                    alt.Tooltip('property_size:O', title = 'Property size (sq.m)'),
-                    alt.Tooltip('count()', title = 'Number of observations')
-                ],
-        color = alt.condition(
-            alt.datum.property_size == size,
-            alt.value(colours['Nephritis']), 
-            alt.value(colours['Peter River']))
-    )
-
-    count = alt.Chart(df).mark_bar(color = 'grey').encode(
-        x = alt.X('property_size:O', sort = 'ascending'),
-        y = 'count()'
-    )
+    with tracer.span("chart_building_size"):
+        show_chart(("building_size", building_name, usage, size), lambda: dtl_charts.building_size_chart(df, size, median, mean))
 
-    st.altair_chart((bar 
-                     + rule_onchart(df, 'annual_amount', 'median') 
-                     + rule_onchart(df, 'annual_amount', 'mean') 
-                     + count), use_container_width=True)
-
-# Drawing a bar chart with a mean line for properties with similar size and highlighting the active bar with a different colour
+# Drawing a bar chart with a mean line for properties with similar size and highlighting the active bar with a different colour.
+# Bars come from the building cube, median/mean lines from the annual amounts of the similar rows only.
 def building_properties_similar(building_name, size, usage):
-    df = data[(data['project'] == building_name) & (data['usage'] == usage) & (data['property_size'].between(size - 10, size + 10))].copy()
-    df.reset_index(drop=True, inplace=True)
+    df, median, mean = dtl_engine.similar_summary(dataset, building_name, usage, size, 10)
 
-    median_str = '{:,.0f}'.format(np.median(df['annual_amount']))
-    mean_str = '{:,.0f}'.format(np.mean(df['annual_amount']))
+    median_str = '{:,.0f}'.format(median)
+    mean_str = '{:,.0f}'.format(mean)
 
     st.markdown(f"##### Prices for similar property size (+/- 10 sq.m) in: {building_name}")
     st.caption(f" {bi_icon('square-fill', 1, colours['Pomegranate'])} Median {median_str} &nbsp;|&nbsp; {bi_icon('square-fill', 1, colours['Orange'])} Mean {mean_str}", unsafe_allow_html=True)
 
-    bar = alt.Chart(df).mark_bar().encode(
-        x = alt.X('property_size:O',
-                sort = 'ascending',
-                axis = alt.Axis(labelAngle = 0),
-                title = "Property size (sq.m)"
-                ),
-        y = alt.Y('mean(annual_amount):Q', title = "Annual price [MEAN]"),
-        tooltip = [
-                    alt.Tooltip('mean(annual_amount):Q', title = 'Mean Annual amount', format = ',.0f'),
-                    alt.Tooltip('property_size:O', title = 'Property size (sq.m)'),
-                    alt.Tooltip('count()', title = 'Number of observations')
-                ],
-        color = alt.condition(
-            alt.datum.property_size == size,
-            alt.value(colours['Nephritis']), 
-            alt.value(colours['Peter River']))
-     )
-
-    count = alt.Chart(df).mark_bar(color = 'gray').encode(
-        x = alt.X('property_size:O', sort = 'ascending'),
-        y = 'count()'
-    )
-
-    st.altair_chart((bar 
-                     + rule_onchart(df, 'annual_amount', 'mean') 
-                     + rule_onchart(df, 'annual_amount', 'median') 
-                     + count), use_container_width = True)
+    with tracer.span("chart_building_similar"):
+        show_chart(("building_similar", building_name, usage, size), lambda: dtl_charts.building_similar_chart(df, size, median, mean))
     
-# Property renting prices chart
-def pid_prices(pid):
-    """Property renting prices chart"""
+# Bar chart of comparable rents (same usage, +/- 10 sq.m, last 12 months) in the buildings around,
+# found through the spatial index over the project locations, closest buildings first
+def comparable_rents(building_name, size, usage):
+    st.markdown(f"##### Comparable rents around: {building_name}")
+    km = st.slider("Within (km)", min_value = 0.5, max_value = 5.0, value = 2.0, step = 0.5)
+    df, median, mean = dtl_engine.comparable_rents(dataset, building_name, usage, size, km)
 
-    pid_data = data[data['pid'] == pid]
-    
-    pidchart_title = f"Property renting prices for all avalible period"
-    pid_altairchart = alt.Chart(pid_data).mark_line(point = alt.OverlayMarkDef(size = 100, filled = False, fill = "white")).encode(
-        alt.X('start_date:T', title = 'Renting start dates'),
-        alt.Y('annual_amount:Q', title = 'Annual amount'),
-        tooltip=[
-            alt.Tooltip('start_date:T', title = 'Start ranting date'),
-            alt.Tooltip('end_date:T', title = 'End ranting date'),
-            alt.Tooltip('annual_amount:Q', title = 'Annual amount', format = ',.0f'),
-            alt.Tooltip('contract_amount:Q', title = 'Contract amount', format = ',.0f'),
-            alt.Tooltip('version', title = 'New/Renewed'),
-        ]
-    ).properties(
-        title = alt.TitleParams(
-            text = pidchart_title,
-            fontSize = 16,
-            color = 'gray'
-        )
-    )
+    if len(df) == 0:
+        st.markdown(f"Sorry, but there are :red[no comparable contracts] around {building_name} 😢")
+        return
+
+    median_str = '{:,.0f}'.format(median)
+    mean_str = '{:,.0f}'.format(mean)
+    st.caption(f" {bi_icon('square-fill', 1, colours['Pomegranate'])} Median {median_str} &nbsp;|&nbsp; {bi_icon('square-fill', 1, colours['Orange'])} Mean {mean_str} &nbsp;|&nbsp; {df['contracts'].sum():,} contracts of {usage.lower()} properties of {size - 10:,.0f}-{size + 10:,.0f} sq.m in {len(df):,} buildings, last 12 months", unsafe_allow_html=True)
+
+    with tracer.span("chart_comparable"):
+        show_chart(("comparable", building_name, usage, size, km), lambda: dtl_charts.comparable_chart(df.head(25), building_name, median, mean))
 
-    text = pid_altairchart.mark_text(
-        align = "left",
-        baseline = "middle",
-        fontSize = 13,
-        dx = 8,
-        dy = -15,
-        color = '#fff'
-    ).encode(text = "annual_amount:Q")
+# Property renting prices chart
+def pid_prices(pid, pid_data):
+    """Property renting prices chart"""
 
-    st.altair_chart(pid_altairchart + text, use_container_width = True)
+    with tracer.span("chart_rent_history"):
+        show_chart(("rent_history", pid), lambda: dtl_charts.rent_history_chart(pid_data))
 
 add_logo()
 
@@ -282,19 +222,60 @@ with ecn_message:
 
 
 load_status = st.sidebar.warning('Wait, please. Loading all data and caching it for a quicker access later.')
-data = load_data()
-projects = load_projects()
+live = tracer.cached("data_load", load_dataset)
+dataset = live.current  # the same dataset for the whole rerun, even when an ingest replaces it meanwhile
 load_status.success('All data has been loaded successfully and cached!')
 
 
 st.sidebar.markdown("#### Clear all cache!")
 with st.sidebar.expander("🧹 Clear all cache!"):
     if st.button("clear and reload"):
-        st.cache_data.clear()
+        dtl_data.build_snapshot("data", downloads.fetch(DATA_URL), SNAPSHOT_DIR, INGEST_AREAS, INGEST_BUDGET, INGEST_WORKERS)
+        dtl_data.build_snapshot("projects", downloads.fetch(DATA_URL_PROJECTS), SNAPSHOT_DIR, INGEST_AREAS, INGEST_BUDGET, INGEST_WORKERS)
+        # only the dataset: the download cache may be writing in the background and the counters
+        # stay, the new dataset version empties the view cache
+        load_dataset.clear()
         st.experimental_rerun()
 
-def is_there(number,column):
-    if np.isin(number, data[column].values):
+# Incremental refresh, only the contracts registered since the last one are read and added
+with st.sidebar.expander("🔄 Fetch new contracts"):
+    if st.button("fetch new contracts"):
+        new, amended = live.ingest(downloads.fetch(st.secrets.get("DATA_URL_DELTA", DATA_URL)))
+        dataset = live.current
+        st.success(f"{new:,} new and {amended:,} amended contracts added")
+    status = downloads.status(DATA_URL)
+    if status["downloaded_at"]:
+        st.caption(f"Contracts file downloaded {status['downloaded_at']}, last checked {status['checked_at']}"
+                   + (" (checking now)" if status["refreshing"] else ""))
+
+with st.sidebar.expander("🧠 Memory report"):
+    report = dtl_dataset.memory_report(dataset)
+    st.markdown(f"""
+        Rows: **{report['rows']:,}**\n
+        Shared tables: **{report['table_bytes'] / 2**20:,.1f} MB**\n
+        Indexes and cube: **{(report['index_bytes'] + report['cube_bytes']) / 2**20:,.1f} MB**\n
+        Memory-mapped snapshot: **{report['mapped_snapshot_bytes'] / 2**20:,.1f} MB**\n
+        Process resident: **{(report['process_resident_bytes'] or 0) / 2**20:,.1f} MB**
+        """)
+    for name, counter in views.stats().items():
+        st.markdown(f"Cached {name}: **{counter['entries']:,}** ({counter['bytes'] / 2**20:,.1f} MB), "
+                    f"{counter['hits']:,} hits, {counter['misses']:,} misses, {counter['evictions']:,} evicted")
+
+# How many contracts found their building in the projects file, by exact or normalized name
+with st.sidebar.expander("🔗 Building info coverage"):
+    coverage = dataset.project_dimension.coverage
+    st.markdown(f"""
+        Contracts with building info: **{coverage['coverage']:.1%}**\n
+        Exact name: **{coverage['exact']:,}** &nbsp;|&nbsp; Normalized name: **{coverage['normalized']:,}**\n
+        Unmatched: **{coverage['unmatched']:,}** &nbsp;|&nbsp; No building: **{coverage['without_project']:,}**
+        """, unsafe_allow_html = True)
+    if coverage['top_unmatched']:
+        st.caption("Unmatched buildings (contracts): " + ", ".join(f"{name} ({count:,})" for name, count in coverage['top_unmatched'].items()))
+
+def is_there(number):
+    with tracer.span("ecn_check"):
+        found = dtl_engine.has_contract(dataset, number)
+    if found:
         return True
     else:
         st.error(f"😢 Sorry, but Ejari number **:red[{number}]** is not found. ")
@@ -319,33 +300,18 @@ def period_between_dates(dataframe, start_date_column, end_date_column):
     # return a formatted string with the period between the minimum and maximum dates
     return f"{years} years {months} months {days} days"
 
-ecn_exist = st.session_state['ecn'] != '' and is_there(st.session_state['ecn'],"ecn")
+ecn_exist = st.session_state['ecn'] != '' and is_there(st.session_state['ecn'])
 
 if ecn_exist:
     # Gathering all relevant data
-    ecn_data = data[data['ecn'] == st.session_state['ecn']].copy()
-    ecn_data.fillna("Missing Data", inplace = True)
-    ecn_data = ecn_data.reset_index(drop=True)
-
-    property_dict = {
-        "start_date": ecn_data['start_date'].min().strftime('%d %b %Y'),
-        "end_date": ecn_data['end_date'].max().strftime('%d %b %Y'),
-        "pid": ecn_data['pid'].iloc[0],
-        "area": ecn_data['area'].iloc[0],
-        "property_size": ecn_data['property_size'].iloc[0],
-        "usage": f"{ecn_data['usage'].iloc[0]}",
-        "project": f"{ecn_data['project'].iloc[0]}",
-        "property_type": f"{ecn_data['property_type'].iloc[0]}",
-        "property_subtype": f"{ecn_data['property_subtype'].iloc[0]}",
-        "nearest_metro": f"{ecn_data['nearest_metro'].iloc[0]}",
-        "nearest_mall": f"{ecn_data['nearest_mall'].iloc[0]}",
-    }
+    with tracer.span("ecn_filter"):
+        view = views.view(dataset, st.session_state['ecn'])
+        ecn_data, property_dict = view["contracts"], view["property"]
 
     # Building up the layout
     st.markdown(f"#### Data found for Ejari: **:green[{st.session_state['ecn']}]**")
     
     # Display the table with ECN avalible in DB
-    ecn_data.reset_index(drop = True, inplace = True)
     # st.dataframe(ecn_data.style.format(precision = 2, thousands = ''), use_container_width = True)
     st.markdown("___")
 
@@ -381,67 +347,104 @@ if ecn_exist:
 
 if ecn_exist:
     st.markdown(f"#### {bi_icon('bar-chart', 1.5, colours['Concrete'])} Property renting prices", unsafe_allow_html=True)
-    pid_prices(property_dict['pid'])
+    pid_prices(property_dict['pid'], view["history"])
+
+# Rent index: how the building and the area trended, with the property's own contracts on top
+if ecn_exist and property_dict['project'] != "Missing Data":
+    st.markdown(f"##### Rent index of {property_dict['project']} and {property_dict['area']} ({property_dict['usage'].lower()})")
+    period = st.radio("Median by", ("month", "quarter"), horizontal = True)
+    with tracer.span("chart_rent_index"):
+        show_chart(("rent_index", property_dict['project'], property_dict['usage'], property_dict['area'], period, property_dict['pid']),
+                   lambda: dtl_charts.rent_index_chart(dtl_engine.rent_index(dataset, property_dict['project'], property_dict['usage'], property_dict['area'], period),
+                                                       view["history"]))
+
+# Fair price: where the tenant's annual amount ranks among comparable contracts
+if ecn_exist and property_dict['project'] != "Missing Data" and property_dict['property_size'] != "Missing Data":
+    st.markdown(f"#### {bi_icon('percent', 1.5, colours['Concrete'])} Fair price", unsafe_allow_html=True)
+    own_rows = ecn_data[ecn_data['pid'] == property_dict['pid']]
+    own_amount = own_rows.loc[own_rows['start_date'].idxmax(), 'annual_amount']
+    scope = st.radio("Compare with", dtl_engine.FAIR_PRICE_SCOPES, horizontal = True,
+                     format_func = lambda scope: {"size band": "similar size in the building", "building": "whole building", "area": "whole area"}[scope])
+    with tracer.span("fair_price"):
+        fair = dtl_engine.fair_price(dataset, own_amount, property_dict['project'], property_dict['usage'],
+                                     property_dict['property_size'], property_dict['area'], scope)
+    if fair['contracts'] == 0:
+        st.markdown(f"Sorry, but there are :red[no comparable contracts] to rank your rent 😢")
+    else:
+        st.markdown(f"""
+            Your annual amount of **{own_amount:,.0f}** is higher than **{fair['percentile']:.0f}%** of {fair['contracts']:,} comparable contracts\n
+            {bi_icon('square-fill', 1, colours['Pomegranate'])} Median {fair['median']:,.0f} &nbsp;|&nbsp; 25th-75th percentile {fair['q25']:,.0f} - {fair['q75']:,.0f}
+            """, unsafe_allow_html=True)
 
 # Building
 if ecn_exist and property_dict['project'] != "Missing Data":
     st.markdown(f"#### {bi_icon('info-square', 1.5, colours['Concrete'])} Building's Information for {property_dict['project']}", unsafe_allow_html=True)
 
-    current_project = projects[projects['project_name'] == property_dict['project']].copy()
-
-    project_dict = {
-        "project_name": current_project['project_name'].iloc[0],
-        "developer_name": current_project['developer_name'].iloc[0],
-        "start_date": current_project['start_date'].iloc[0].strftime('%d %b %Y'),
-        "completion_date": current_project['completion_date'].iloc[0].strftime('%d %b %Y'),
-        "area": current_project['area'].iloc[0],
-        "total_units": f"{current_project['total_units'].fillna(0).astype(int).iloc[0]}",
-        "lat": f"{float(current_project['lat'].iloc[0])}",
-        "long": f"{float(current_project['long'].iloc[0])}",
-    }
-     
-    # Description & Map
-    bld_decription, bld_map = st.columns([1,2])
-    with bld_decription: 
-        st.markdown(f"##### {bi_icon('building', 1, colours['Concrete'])} **Building description**", unsafe_allow_html=True)
-        st.markdown(f"""
-            Developer: **{project_dict['developer_name']}**\n
-            Construction dates: **{project_dict['start_date']} - {project_dict['completion_date']}**\n
-            Total units: **{project_dict['total_units'] if project_dict['total_units'] != 0 else ":red[Missing Data]"}**\n
-            Transport station: **{property_dict['nearest_metro']}**\n
-            Shopping centre: **{property_dict['nearest_mall']}**\n
-            Area: **{project_dict['area'] if project_dict['area'] != 0 else ":red[Missing Data]"}**\n
-            """ , unsafe_allow_html=True)
-    with bld_map:
-        def map_location(lat, long):
-            st.pydeck_chart(pdk.Deck(
-                map_style = 'mapbox://styles/mapbox/dark-v11',
-                initial_view_state = pdk.ViewState(
-                    latitude = 25.0813566,
-                    longitude = 55.1364633,
-                    zoom = 12.5,
-                    height = 300,
-                    # width = 300
-                ),
-                layers=[
-                    pdk.Layer(
-                        'ScatterplotLayer',
-                        data = current_project,
-                        get_position = '[long, lat]',
-                        get_color = '[39, 174, 96, 160]',
-                        get_radius = 100,
-                        auto_highlight = True
+    with tracer.span("project_join"):
+        current_project, project_dict = dtl_engine.project_overview(dataset, property_dict['project'])
+
+    if project_dict is None:
+        st.markdown(f"Sorry, but building's :red[info is missing] for {property_dict['project']} 😢")
+    else:
+        # Description & Map
+        bld_decription, bld_map = st.columns([1,2])
+        with bld_decription: 
+            st.markdown(f"##### {bi_icon('building', 1, colours['Concrete'])} **Building description**", unsafe_allow_html=True)
+            st.markdown(f"""
+                Developer: **{project_dict['developer_name']}**\n
+                Construction dates: **{project_dict['start_date']} - {project_dict['completion_date']}**\n
+                Total units: **{project_dict['total_units'] if project_dict['total_units'] != "Missing Data" else ":red[Missing Data]"}**\n
+                Transport station: **{property_dict['nearest_metro']}**\n
+                Shopping centre: **{property_dict['nearest_mall']}**\n
+                Area: **{project_dict['area'] if project_dict['area'] != "Missing Data" else ":red[Missing Data]"}**\n
+                """ , unsafe_allow_html=True)
+        with bld_map:
+            def map_location(lat, long):
+                return pdk.Deck(
+                    map_style = 'mapbox://styles/mapbox/dark-v11',
+                    initial_view_state = pdk.ViewState(
+                        latitude = 25.0813566,
+                        longitude = 55.1364633,
+                        zoom = 12.5,
+                        height = 300,
+                        # width = 300
                     ),
-                ],
-            ))
-        
-        map_location(project_dict['lat'], project_dict['long'])
+                    layers=[
+                        pdk.Layer(
+                            'ScatterplotLayer',
+                            data = current_project,
+                            get_position = '[long, lat]',
+                            get_color = '[39, 174, 96, 160]',
+                            get_radius = 100,
+                            auto_highlight = True
+                        ),
+                    ],
+                )
+
+            # one map per building, shared by its tenants
+            with tracer.span("map_build"):
+                st.pydeck_chart(views.chart(dataset, ("map", property_dict['project']),
+                                            lambda: map_location(project_dict['lat'], project_dict['long'])))
 
 
 if ecn_exist and property_dict['project'] != "Missing Data":
     building_properties_size(property_dict['project'],property_dict['property_size'],property_dict['usage'])
     building_properties_similar(property_dict['project'],property_dict['property_size'],property_dict['usage'])
+    if property_dict['property_size'] != "Missing Data":
+        comparable_rents(property_dict['project'],property_dict['property_size'],property_dict['usage'])
 elif ecn_exist and property_dict['project'] == "Missing Data":
     st.markdown(f"Sorry, but building's :red[info is missing] for the property. There's nothing to show 😢")
 
 st.markdown("___")
+tracer.end_rerun()
+
+# Operator view of the timings above, only when DEBUG_TIMINGS is on
+if tracer.enabled:
+    with st.sidebar.expander("⏱️ Timings"):
+        st.caption("Latency of each stage over the latest reruns of every session (ms)")
+        st.dataframe(tracer.summary().style.format(precision = 2), use_container_width = True)
+        for name, counter in tracer.cache_counters().items():
+            st.markdown(f"Cache **{name}**: {counter['hits']:,} hits, {counter['misses']:,} misses ({counter['hit_rate']:.0%} hit rate)")
+        st.download_button("export as JSON lines", tracer.json_lines(), file_name = "dtl_timings.jsonl", mime = "application/json")
+        if st.button("reset timings"):
+            tracer.reset()
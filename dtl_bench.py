@@ -0,0 +1,393 @@
+"""Benchmarks of Dubai Tenancy Lookup on synthetic DLD-scale data.
+
+Generates seeded rent contracts and projects CSVs with the same columns as the
+real ones, then times the load and lookup paths of the app at each scale.
+Every scale runs in its own process, so the peak memory is its own, and the
+results are appended as JSON lines to compare versions:
+
+    python dtl_bench.py generate --rows 1000000 --out bench_data
+    python dtl_bench.py run --rows 100000 1000000 10000000 --results bench_results.jsonl
+    python dtl_bench.py compare old_results.jsonl bench_results.jsonl
+    python dtl_bench.py parallel --data bench_data/1000000/data.csv --workers 1 2 4 8
+"""
+import argparse
+import ctypes
+import datetime
+import gc
+import json
+import os
+import pickle
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import dtl_charts
+import dtl_data
+import dtl_dataset
+import dtl_engine
+import dtl_parallel
+import dtl_viewcache
+
+# Areas with their rough location and rent per sq.m per year (AED) for the generator
+AREAS = {
+    "Marsa Dubai": (25.0805, 55.1403, 1050),
+    "Business Bay": (25.1865, 55.2650, 1100),
+    "Burj Khalifa": (25.1972, 55.2744, 1500),
+    "Palm Jumeirah": (25.1124, 55.1390, 1400),
+    "Al Barsha South Fourth": (25.0590, 55.2090, 750),
+    "Al Thanyah Fifth": (25.0693, 55.1412, 900),
+    "Al Barsha First": (25.1106, 55.1960, 850),
+    "Nadd Hessa": (25.1210, 55.3850, 600),
+    "Warsan First": (25.1650, 55.4080, 450),
+    "Al Qusais Industrial Fifth": (25.2830, 55.3880, 500),
+    "Jabal Ali First": (25.0190, 55.1240, 550),
+    "Al Karama": (25.2450, 55.3030, 800),
+}
+METROS = ["DMCC Metro Station", "Dubai Marina", "Sobha Realty Metro Station", "Business Bay Metro Station",
+          "Burj Khalifa Dubai Mall Metro Station", "Mall of the Emirates Metro Station", "Rashidiya Metro Station"]
+MALLS = ["Marina Mall", "Dubai Mall", "Mall of the Emirates", "Ibn-e-Battuta Mall", "City Centre Mirdif"]
+# (subtype, usage, typical sizes in sq.m)
+UNIT_TYPES = [
+    ("Flat", "Residential", [38.5, 72.3, 112.8, 158.4, 225.6]),
+    ("Office", "Commercial", [55.7, 96.2, 148.9, 310.0]),
+    ("Shop", "Commercial", [42.1, 85.0, 160.3]),
+    ("Villa", "Residential", [280.0, 390.5, 520.0]),
+]
+FIRST_YEAR = 2010
+LAST_YEAR = 2022
+PROPERTIES_PER_BATCH = 200_000
+
+
+def synthetic_projects(n_projects, seed):
+    rng = np.random.default_rng([seed, 0])
+    names = list(AREAS)
+    area = rng.choice(len(names), n_projects, p = np.linspace(2, 1, len(names)) / np.linspace(2, 1, len(names)).sum())
+    lat = np.array([AREAS[names[a]][0] for a in area]) + rng.normal(0, 0.006, n_projects)
+    long = np.array([AREAS[names[a]][1] for a in area]) + rng.normal(0, 0.006, n_projects)
+    start = pd.to_datetime("2000-01-01") + pd.to_timedelta(rng.integers(0, 365 * 18, n_projects), unit = "D")
+    total_units = np.round(rng.lognormal(5.2, 0.7, n_projects))
+    total_units[rng.random(n_projects) < 0.05] = np.nan
+    return pd.DataFrame({
+        "project_name": [f"{names[a].split()[0]} Residence {i}" for i, a in enumerate(area)],
+        "developer_name": rng.choice(["Emaar", "Select Group", "Damac", "Nakheel", "Sobha", "Omniyat"], n_projects),
+        "start_date": start.strftime("%Y-%m-%d"),
+        "completion_date": (start + pd.to_timedelta(rng.integers(500, 1500, n_projects), unit = "D")).strftime("%Y-%m-%d"),
+        "area": [names[a] for a in area],
+        "total_units": total_units,
+        "lat": lat,
+        "long": long,
+        "area_index": area,
+    })
+
+# Contracts of properties [first, first + count): every property is rented year after year
+# from a random year on, the first contract is "New" and the following ones "Renewed"
+def synthetic_contracts(projects, first, count, seed, batch):
+    rng = np.random.default_rng([seed, batch + 1])
+    pid = np.arange(first, first + count, dtype = np.int64) + 1_000_000
+    project = rng.integers(0, len(projects), count)
+    unit_type = rng.choice(len(UNIT_TYPES), count, p = [0.78, 0.12, 0.06, 0.04])
+    size_table = np.array([t[2] + [np.nan] * (5 - len(t[2])) for t in UNIT_TYPES])
+    size_count = np.array([len(t[2]) for t in UNIT_TYPES])
+    sizes = size_table[unit_type, (rng.random(count) * size_count[unit_type]).astype(int)]
+    first_year = rng.integers(FIRST_YEAR, LAST_YEAR + 1, count)
+    years = rng.geometric(0.3, count).clip(1, LAST_YEAR - first_year + 1)
+
+    row_property = np.repeat(np.arange(count), years)
+    renewal = np.arange(len(row_property)) - np.repeat(np.cumsum(years) - years, years)
+    n = len(row_property)
+
+    start = ((first_year[row_property] - 1970).astype("datetime64[Y]").astype("datetime64[D]")
+             + renewal * 365 + rng.integers(0, 365, n))
+    year = start.astype("datetime64[Y]").astype(int) + 1970
+    area_rent = np.array([AREAS[a][2] for a in AREAS])[projects["area_index"].to_numpy()[project[row_property]]]
+    market = 1 + 0.04 * (year - FIRST_YEAR) + 0.25 * (year >= 2022)
+    annual = (area_rent * sizes[row_property] * market * rng.lognormal(0, 0.18, n)).round(-2).astype(np.int64)
+
+    frame = pd.DataFrame({
+        "ecn": rng.integers(10**14, 10**15, n),
+        "pid": pid[row_property],
+        "registration_date": np.datetime_as_string(start - rng.integers(0, 30, n), unit = "D"),
+        "start_date": np.datetime_as_string(start, unit = "D"),
+        "end_date": np.datetime_as_string(start + 364, unit = "D"),
+        "version": np.where(renewal == 0, "New", "Renewed"),
+        "area": projects["area"].to_numpy()[project[row_property]],
+        "contract_amount": annual,
+        "annual_amount": annual,
+        "property_type": np.where(unit_type[row_property] == 3, "Villa", "Unit"),
+        "property_subtype": np.array([t[0] for t in UNIT_TYPES])[unit_type[row_property]],
+        "property_size": sizes[row_property],
+        "usage": np.array([t[1] for t in UNIT_TYPES])[unit_type[row_property]],
+        "nearest_metro": rng.choice(METROS, n),
+        "nearest_mall": rng.choice(MALLS, n),
+        "project": projects["project_name"].to_numpy()[project[row_property]],
+    })
+    # a few rows with missing building information, like in the DLD data
+    for column, share in (("project", 0.03), ("nearest_metro", 0.05), ("nearest_mall", 0.05)):
+        frame.loc[rng.random(n) < share, column] = np.nan
+    return frame
+
+# Writing about `rows` contracts and the matching projects to out/data.csv and out/projects.csv
+def generate(rows, out, seed = 42):
+    os.makedirs(out, exist_ok = True)
+    n_properties = max(rows // 3, 1)  # ~3 contracts per property on average
+    projects = synthetic_projects(max(n_properties // 150, 20), seed)
+    projects.drop(columns = "area_index").to_csv(os.path.join(out, "projects.csv"), index = False)
+
+    data_path = os.path.join(out, "data.csv")
+    written = 0
+    for batch, first in enumerate(range(0, n_properties, PROPERTIES_PER_BATCH)):
+        count = min(PROPERTIES_PER_BATCH, n_properties - first)
+        contracts = synthetic_contracts(projects, first, count, seed, batch)
+        contracts.to_csv(data_path, mode = "w" if batch == 0 else "a", header = batch == 0, index = False)
+        written += len(contracts)
+    return data_path, os.path.join(out, "projects.csv"), written
+
+
+# Peak resident memory of this process so far
+def max_rss_bytes():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+# Median wall time of a call, and the peak resident memory of the process once it returned
+def measure(results, name, function, *args, repeat = 1):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        value = function(*args)
+        timings.append(time.perf_counter() - started)
+    results[name] = {"seconds": float(np.median(timings)), "max_rss_bytes": max_rss_bytes(), "repeat": repeat}
+    return value
+
+def sample_ecns(dataset, n, seed):
+    rng = np.random.default_rng(seed)
+    return dataset.data['ecn'].to_numpy()[rng.integers(0, len(dataset.data), n)]
+
+# One page load for an ECN, the way the app does it, minus Streamlit
+def page_lookup(dataset, ecn):
+    property_dict = dtl_engine.property_overview(dtl_engine.contract_rows(dataset, ecn))
+    dtl_engine.rent_history(dataset, property_dict['pid'])
+    if property_dict['project'] != dtl_engine.MISSING:
+        project, usage, size = property_dict['project'], property_dict['usage'], property_dict['property_size']
+        dtl_engine.project_overview(dataset, project)
+        dtl_engine.building_summary(dataset, project, usage)
+        dtl_engine.similar_summary(dataset, project, usage, size)
+    return property_dict
+
+# The Vega-Lite specs of the page charts for an ECN, returns their JSON size
+def chart_specs(dataset, ecn):
+    property_dict = dtl_engine.property_overview(dtl_engine.contract_rows(dataset, ecn))
+    specs = [dtl_charts.rent_history_chart(dtl_engine.rent_history(dataset, property_dict['pid'])).to_dict()]
+    if property_dict['project'] != dtl_engine.MISSING:
+        project, usage, size = property_dict['project'], property_dict['usage'], property_dict['property_size']
+        sizes, median, mean = dtl_engine.building_summary(dataset, project, usage)
+        specs.append(dtl_charts.building_size_chart(sizes, size, median, mean).to_dict())
+        similar, similar_median, similar_mean = dtl_engine.similar_summary(dataset, project, usage, size)
+        specs.append(dtl_charts.building_similar_chart(similar, size, similar_median, similar_mean).to_dict())
+    return sum(len(json.dumps(spec, default = str)) for spec in specs)
+
+# The same page through the view cache, the way the app renders it on a rerun
+def cached_page(views, dataset, ecn):
+    view = views.view(dataset, ecn)
+    property_dict = view["property"]
+    views.chart(dataset, ("rent_history", property_dict['pid']),
+                lambda: dtl_charts.chart_spec(dtl_charts.rent_history_chart(view["history"])))
+    if property_dict['project'] != dtl_engine.MISSING:
+        project, usage, size = property_dict['project'], property_dict['usage'], property_dict['property_size']
+        sizes, median, mean = dtl_engine.building_summary(dataset, project, usage)
+        views.chart(dataset, ("building_size", project, usage, size),
+                    lambda: dtl_charts.chart_spec(dtl_charts.building_size_chart(sizes, size, median, mean)))
+        similar, similar_median, similar_mean = dtl_engine.similar_summary(dataset, project, usage, size)
+        views.chart(dataset, ("building_similar", project, usage, size),
+                    lambda: dtl_charts.chart_spec(dtl_charts.building_similar_chart(similar, size, similar_median, similar_mean)))
+    return property_dict
+
+# Handing the memory freed by the earlier stages back to the OS (glibc only), so that
+# new allocations show up in the resident size instead of reusing it
+def release_free_memory():
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+# Resident memory added by `sessions` simulated sessions, each holding what `open_session()` returns
+def session_memory(results, name, open_session, sessions = 5):
+    release_free_memory()
+    before = dtl_dataset.resident_bytes()
+    held = measure(results, name, lambda: [open_session() for _ in range(sessions)])
+    after = dtl_dataset.resident_bytes()
+    results[name]["seconds"] /= sessions
+    results[name]["resident_bytes_per_session"] = None if before is None else (after - before) / sessions
+    del held
+
+# All the stages over the generated CSVs of `workdir`, in this process
+def run_scale(workdir, seed, lookups):
+    results = {}
+    data_path, projects_path = os.path.join(workdir, "data.csv"), os.path.join(workdir, "projects.csv")
+    snapshot_dir = os.path.join(workdir, "snapshot")
+    shutil.rmtree(snapshot_dir, ignore_errors = True)
+
+    measure(results, "csv_parse", lambda: dtl_data.parse_data_csv(dtl_data.read_source(data_path)))
+    measure(results, "csv_stream", dtl_data.stream_csv, "data", data_path)
+    measure(results, "cold_load", dtl_dataset.Dataset.load, data_path, projects_path, snapshot_dir)
+    dataset = measure(results, "warm_load", dtl_dataset.Dataset.load, data_path, projects_path, snapshot_dir)
+
+    ecns = sample_ecns(dataset, lookups, seed)
+    measure(results, "single_ecn_lookup", lambda: [dtl_engine.contract_rows(dataset, ecn) for ecn in ecns])
+    measure(results, "warm_rerun", lambda: [page_lookup(dataset, ecn) for ecn in ecns])
+    # Altair validates every spec it builds, a few lookups are enough
+    payload = measure(results, "chart_specs", lambda: [chart_specs(dataset, ecn) for ecn in ecns[:20]])
+    # the same lookups on a rerun: the first pass fills the view cache, the second one is served by it
+    views = dtl_viewcache.ViewCache()
+    measure(results, "view_cache_fill", lambda: [cached_page(views, dataset, ecn) for ecn in ecns[:20]])
+    measure(results, "view_cache_hit", lambda: [cached_page(views, dataset, ecn) for ecn in ecns[:20]])
+    # st.cache_data pickled the tables once and handed every session an unpickled copy,
+    # st.cache_resource hands it the shared dataset
+    pickled = pickle.dumps((dataset.data, dataset.projects), protocol = pickle.HIGHEST_PROTOCOL)
+    session_memory(results, "session_copy", lambda: pickle.loads(pickled))
+    del pickled
+    session_memory(results, "session_shared", lambda: dataset)
+    measure(results, "batch_lookup", dtl_engine.batch_lookup, dataset, sample_ecns(dataset, 10_000, seed))
+    # the full-column scan every lookup used to do, for reference
+    measure(results, "ecn_scan", lambda: [np.flatnonzero(dataset.data['ecn'].to_numpy() == ecn) for ecn in ecns])
+
+    for name in ("single_ecn_lookup", "warm_rerun", "ecn_scan"):
+        results[name]["seconds"] /= len(ecns)  # per lookup
+    results["chart_specs"]["seconds"] /= len(payload)
+    results["chart_specs"]["payload_bytes"] = int(np.mean(payload))
+    for name in ("view_cache_fill", "view_cache_hit"):
+        results[name]["seconds"] /= len(ecns[:20])
+    results["view_cache_hit"]["hit_rate"] = views.stats()["views"]["hit_rate"]
+    results["batch_lookup"]["contracts_per_second"] = 10_000 / results["batch_lookup"]["seconds"]
+
+    return {
+        "rows": len(dataset.data),
+        "stages": results,
+        "max_rss_bytes": max_rss_bytes(),
+    }
+
+def version_info():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output = True, text = True,
+                                cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit or None,
+        "snapshot_version": dtl_data.SNAPSHOT_VERSION,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "timestamp": datetime.datetime.now().isoformat(timespec = "seconds"),
+    }
+
+# Each scale generated then measured in fresh interpreters (so the generator's memory
+# doesn't count), appending one JSON line per scale to `results_path`
+def run(scales, workdir, results_path, seed = 42, lookups = 200):
+    script = os.path.abspath(__file__)
+    for rows in scales:
+        out = os.path.join(workdir, str(rows))
+        started = time.perf_counter()
+        subprocess.run([sys.executable, script, "generate", "--rows", str(rows), "--out", out, "--seed", str(seed)],
+                       capture_output = True, check = True)
+        generated = time.perf_counter() - started
+
+        command = [sys.executable, script, "scale", "--workdir", out, "--seed", str(seed), "--lookups", str(lookups)]
+        output = subprocess.run(command, capture_output = True, text = True, check = True).stdout
+        result = {**version_info(), "target_rows": rows, **json.loads(output.strip().splitlines()[-1])}
+        result["generate_seconds"] = generated
+        with open(results_path, "a") as f:
+            f.write(json.dumps(result) + "\n")
+        print_result(result)
+
+def print_result(result):
+    print(f"{result['rows']:,} rows (generated in {result['generate_seconds']:,.1f}s), "
+          f"max RSS {result['max_rss_bytes'] / 2**20:,.0f} MB")
+    for name, stage in result["stages"].items():
+        per_session = stage.get("resident_bytes_per_session")
+        print(f"  {name:<20} {stage['seconds'] * 1000:>12,.3f} ms  max RSS {stage['max_rss_bytes'] / 2**20:>9,.1f} MB"
+              + (f"  {per_session / 2**20:,.2f} MB per session" if per_session is not None else ""))
+
+def read_results(path):
+    with open(path) as f:
+        return {result["target_rows"]: result for result in map(json.loads, f) if "target_rows" in result}
+
+# Ratio new/old of every stage at every scale both files have (the latest run of each)
+def compare(old_path, new_path):
+    old, new = read_results(old_path), read_results(new_path)
+    for rows in sorted(set(old) & set(new)):
+        print(f"{rows:,} rows ({old[rows].get('commit')} -> {new[rows].get('commit')})")
+        for name, stage in new[rows]["stages"].items():
+            if name in old[rows]["stages"]:
+                ratio = stage["seconds"] / max(old[rows]["stages"][name]["seconds"], 1e-12)
+                print(f"  {name:<20} x{ratio:,.2f}{'  <- slower' if ratio > 1.1 else ''}")
+
+# Parse time of the parallel ingest at every worker count, against the streaming ingest of the
+# same file (one JSON line per worker count). Speedups above the machine's core count are not expected.
+def parallel_speedup(data_path, worker_counts, results_path, repeat = 3):
+    results = {}
+    measure(results, "csv_stream", dtl_data.stream_csv, "data", data_path, repeat = repeat)
+    baseline = results["csv_stream"]["seconds"]
+    print(f"{os.path.getsize(data_path) / 2**20:,.0f} MB on {os.cpu_count()} cores, "
+          f"streaming ingest {baseline:,.2f}s")
+    for workers in worker_counts:
+        measure(results, f"parallel_{workers}", dtl_parallel.parse_parallel, "data", data_path, workers, repeat = repeat)
+        stage = results[f"parallel_{workers}"]
+        result = {**version_info(), "data": data_path, "cores": os.cpu_count(), "workers": workers,
+                  "stream_seconds": baseline, "seconds": stage["seconds"], "speedup": baseline / stage["seconds"]}
+        with open(results_path, "a") as f:
+            f.write(json.dumps(result) + "\n")
+        print(f"  {workers:>3} workers {stage['seconds']:>8,.2f}s  x{result['speedup']:,.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Dubai Tenancy Lookup benchmarks")
+    commands = parser.add_subparsers(dest = "command", required = True)
+
+    gen = commands.add_parser("generate", help = "write synthetic data.csv and projects.csv")
+    gen.add_argument("--rows", type = int, default = 100_000)
+    gen.add_argument("--out", default = "bench_data")
+    gen.add_argument("--seed", type = int, default = 42)
+
+    bench = commands.add_parser("run", help = "benchmark every scale, each in its own process")
+    bench.add_argument("--rows", type = int, nargs = "+", default = [100_000, 1_000_000])
+    bench.add_argument("--workdir", default = "bench_data")
+    bench.add_argument("--results", default = "bench_results.jsonl")
+    bench.add_argument("--seed", type = int, default = 42)
+    bench.add_argument("--lookups", type = int, default = 200, help = "ECNs looked up per stage")
+
+    scale = commands.add_parser("scale", help = "benchmark the generated CSVs of a directory in this process (used by run)")
+    scale.add_argument("--workdir", required = True)
+    scale.add_argument("--seed", type = int, default = 42)
+    scale.add_argument("--lookups", type = int, default = 200)
+
+    comp = commands.add_parser("compare", help = "compare two results files")
+    comp.add_argument("old")
+    comp.add_argument("new")
+
+    par = commands.add_parser("parallel", help = "speedup of the parallel CSV ingest at several worker counts")
+    par.add_argument("--data", required = True, help = "a data.csv written by generate")
+    par.add_argument("--workers", type = int, nargs = "+", default = [1, 2, 4, 8])
+    par.add_argument("--results", default = "bench_results.jsonl")
+    par.add_argument("--repeat", type = int, default = 3)
+
+    args = parser.parse_args()
+    if args.command == "generate":
+        _, _, written = generate(args.rows, args.out, args.seed)
+        print(f"{written:,} contracts -> {args.out}")
+    elif args.command == "run":
+        run(args.rows, args.workdir, args.results, args.seed, args.lookups)
+    elif args.command == "scale":
+        print(json.dumps(run_scale(args.workdir, args.seed, args.lookups)))
+    elif args.command == "compare":
+        compare(args.old, args.new)
+    elif args.command == "parallel":
+        parallel_speedup(args.data, args.workers, args.results, args.repeat)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""Altair charts of the app.
+
+Built from the small frames the lookup engine returns, without Streamlit, so they
+can be timed and reused outside of the page.
+"""
+import threading
+
+import altair as alt
+import pandas as pd
+
+# Altair data transformer keeping the frames out of the spec, by reference, the way st.altair_chart
+# does it: Streamlit sends them as Arrow tables next to the spec instead of inlined JSON values.
+# Registered once, the frames of the chart being converted are collected per thread.
+collected = threading.local()
+# Enabling a data transformer is process-wide, one chart at a time is converted with it
+TRANSFORMER_LOCK = threading.Lock()
+
+def frame_reference(data):
+    datasets = getattr(collected, "datasets", None)
+    if datasets is None:  # another thread's to_dict() while a chart_spec() holds the transformer
+        return alt.default_data_transformer(data)
+    datasets[str(id(data))] = data
+    return {"name": str(id(data))}
+
+alt.data_transformers.register("frame_reference", frame_reference)
+
+# The Vega-Lite spec of a chart (validated once, here) with its frames under "datasets",
+# ready for st.vega_lite_chart. Rendering it again later skips Altair altogether.
+def chart_spec(chart):
+    datasets = collected.datasets = {}
+    try:
+        with TRANSFORMER_LOCK, alt.data_transformers.enable("frame_reference"):
+            spec = chart.to_dict()
+    finally:
+        collected.datasets = None
+    spec["datasets"] = datasets
+    return spec
+
+# Custom colour set based on https://flatuicolors.com/palette/defo
+colours = {
+    "Turquoise": "#1abc9c",  # greenish blue
+    "Emerald": "#2ecc71",  # bright green
+    "Peter River": "#3498db",  # light blueish
+    "Amethyst": "#9b59b6",  # purple
+    "Wet Asphalt": "#34495e",  # dark grayish blue
+    "Green Sea": "#16a085",  # blueish green
+    "Nephritis": "#27ae60",  # bright greenish blue
+    "Belize Hole": "#2980b9",  # darker blue than Peter River
+    "Wisteria": "#8e44ad",  # purplish blue
+    "Midnight Blue": "#2c3e50",  # dark blue
+    "Sun Flower": "#f1c40f",  # bright yellow
+    "Carrot": "#e67e22",  # orange
+    "Alizarin": "#e74c3c",  # dark red
+    "Clouds": "#ecf0f1",  # light gray
+    "Concrete": "#95a5a6",  # gray
+    "Orange": "#f39c12",  # orange
+    "Pumpkin": "#d35400",  # orangey red
+    "Pomegranate": "#c0392b",  # dark red
+    "Silver": "#bdc3c7",  # light grayish blue
+    "Asbestos": "#7f8c8d",  # dark gray
+    "Cornflower Blue": "#6495ED",
+}
+
+# Drawing measure mean/median rule, the value is already computed so the rule needs a single row
+def rule_onchart(value, measure):
+    rule = alt.Chart(pd.DataFrame({measure: [value]})).mark_rule(color = colours['Pomegranate'] if measure == 'median' else colours['Orange']).encode(
+        y = f"{measure}:Q",
+        size = alt.value(2),
+        tooltip = [
+            alt.Tooltip(f"{measure}:Q", title=f"{measure.capitalize()}", format = ',.0f')
+        ]
+    )
+    return rule
+
+# Bar chart of the median annual amount per property size with median/mean lines,
+# the active bar (the tenant's property size) in a different colour
+def building_size_chart(df, size, median, mean):
+    bar = alt.Chart(df).mark_bar().encode(
+        x = alt.X('property_size:O',
+                # bin=alt.Bin(extent=[df['property_size'].min(), df['property_size'].max()], step=10),
+                sort = 'ascending',
+                axis = alt.Axis(labelAngle = 0),
+                title = "Property size (sq.m)"
+                ),
+        y = alt.Y('median_amount:Q', title = "Annual price [MEDIAN]"),
+        tooltip = [
+                    alt.Tooltip('median_amount:Q', title = 'Median Annual amount', format = ',.0f'),
+                    alt.Tooltip('q25_amount:Q', title = '25th percentile', format = ',.0f'),
+                    alt.Tooltip('q75_amount:Q', title = '75th percentile', format = ',.0f'),
+                    alt.Tooltip('property_size:O', title = 'Property size (sq.m)'),
+                    alt.Tooltip('contracts:Q', title = 'Number of observations')
+                ],
+        color = alt.condition(
+            alt.datum.property_size == size,
+            alt.value(colours['Nephritis']), 
+            alt.value(colours['Peter River']))
+    )
+
+    count = alt.Chart(df).mark_bar(color = 'grey').encode(
+        x = alt.X('property_size:O', sort = 'ascending'),
+        y = 'contracts:Q'
+    )
+
+    return (bar
+            + rule_onchart(median, 'median')
+            + rule_onchart(mean, 'mean')
+            + count)
+
+# Bar chart of the mean annual amount for properties of similar size with mean/median lines
+def building_similar_chart(df, size, median, mean):
+    bar = alt.Chart(df).mark_bar().encode(
+        x = alt.X('property_size:O',
+                sort = 'ascending',
+                axis = alt.Axis(labelAngle = 0),
+                title = "Property size (sq.m)"
+                ),
+        y = alt.Y('mean_amount:Q', title = "Annual price [MEAN]"),
+        tooltip = [
+                    alt.Tooltip('mean_amount:Q', title = 'Mean Annual amount', format = ',.0f'),
+                    alt.Tooltip('property_size:O', title = 'Property size (sq.m)'),
+                    alt.Tooltip('contracts:Q', title = 'Number of observations')
+                ],
+        color = alt.condition(
+            alt.datum.property_size == size,
+            alt.value(colours['Nephritis']), 
+            alt.value(colours['Peter River']))
+     )
+
+    count = alt.Chart(df).mark_bar(color = 'gray').encode(
+        x = alt.X('property_size:O', sort = 'ascending'),
+        y = 'contracts:Q'
+    )
+
+    return (bar
+            + rule_onchart(mean, 'mean')
+            + rule_onchart(median, 'median')
+            + count)
+
+# Bar chart of the median annual amount of comparable properties per nearby building (closest first)
+# with median/mean lines, the tenant's own building in a different colour
+def comparable_chart(df, project, median, mean):
+    bar = alt.Chart(df).mark_bar().encode(
+        x = alt.X('project:N',
+                sort = alt.EncodingSortField('distance_km', order = 'ascending'),
+                axis = alt.Axis(labelAngle = -30),
+                title = "Building/complex (closest first)"
+                ),
+        y = alt.Y('median_amount:Q', title = "Annual price [MEDIAN]"),
+        tooltip = [
+                    alt.Tooltip('project:N', title = 'Building/complex'),
+                    alt.Tooltip('distance_km:Q', title = 'Distance (km)', format = ',.2f'),
+                    alt.Tooltip('median_amount:Q', title = 'Median Annual amount', format = ',.0f'),
+                    alt.Tooltip('mean_amount:Q', title = 'Mean Annual amount', format = ',.0f'),
+                    alt.Tooltip('contracts:Q', title = 'Number of observations')
+                ],
+        color = alt.condition(
+            alt.datum.project == project,
+            alt.value(colours['Nephritis']),
+            alt.value(colours['Peter River']))
+    )
+
+    return (bar
+            + rule_onchart(median, 'median')
+            + rule_onchart(mean, 'mean'))
+
+# Property renting prices chart
+def rent_history_chart(pid_data):
+    pidchart_title = f"Property renting prices for all avalible period"
+    pid_altairchart = alt.Chart(pid_data).mark_line(point = alt.OverlayMarkDef(size = 100, filled = False, fill = "white")).encode(
+        alt.X('start_date:T', title = 'Renting start dates'),
+        alt.Y('annual_amount:Q', title = 'Annual amount'),
+        tooltip=[
+            alt.Tooltip('start_date:T', title = 'Start ranting date'),
+            alt.Tooltip('end_date:T', title = 'End ranting date'),
+            alt.Tooltip('annual_amount:Q', title = 'Annual amount', format = ',.0f'),
+            alt.Tooltip('contract_amount:Q', title = 'Contract amount', format = ',.0f'),
+            alt.Tooltip('version', title = 'New/Renewed'),
+        ]
+    ).properties(
+        title = alt.TitleParams(
+            text = pidchart_title,
+            fontSize = 16,
+            color = 'gray'
+        )
+    )
+
+    text = pid_altairchart.mark_text(
+        align = "left",
+        baseline = "middle",
+        fontSize = 13,
+        dx = 8,
+        dy = -15,
+        color = '#fff'
+    ).encode(text = "annual_amount:Q")
+
+    return pid_altairchart + text
+
+# Rent index of the building and the area (median lines) with the property's own contracts on top
+def rent_index_chart(index, pid_data):
+    lines = alt.Chart(index).mark_line(interpolate = 'monotone').encode(
+        alt.X('date:T', title = 'Renting start dates'),
+        alt.Y('median_amount:Q', title = 'Annual amount [MEDIAN]'),
+        color = alt.Color('series:N', title = None,
+                          scale = alt.Scale(domain = ["Building", "Area"], range = [colours['Peter River'], colours['Concrete']])),
+        tooltip = [
+            alt.Tooltip('series:N', title = 'Index'),
+            alt.Tooltip('date:T', title = 'Period from'),
+            alt.Tooltip('median_amount:Q', title = 'Median Annual amount', format = ',.0f'),
+            alt.Tooltip('contracts:Q', title = 'Number of observations'),
+        ]
+    )
+
+    own = alt.Chart(pid_data).mark_point(size = 100, filled = True, color = colours['Nephritis']).encode(
+        alt.X('start_date:T'),
+        alt.Y('annual_amount:Q'),
+        tooltip = [
+            alt.Tooltip('start_date:T', title = 'Start ranting date'),
+            alt.Tooltip('annual_amount:Q', title = 'Annual amount', format = ',.0f'),
+        ]
+    )
+
+    return lines + own
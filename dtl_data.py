@@ -0,0 +1,531 @@
+"""Data layer for Dubai Tenancy Lookup.
+
+Reading the DLD rent contracts and projects CSVs and keeping a typed columnar
+snapshot of them on disk, so the app doesn't have to parse the CSVs (and their
+dates) on every cold start.
+
+Build the snapshot once with:
+
+    python dtl_data.py build --data <DATA_URL> --projects <DATA_URL_PROJECTS>
+"""
+import argparse
+import datetime
+import glob
+import hashlib
+import io
+import json
+import os
+import urllib.request
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:  # snapshot is optional, the app falls back to the CSV files
+    pa = None
+    feather = None
+
+# Bump it every time the snapshot layout or the schemas below change
+SNAPSHOT_VERSION = 4
+SNAPSHOT_DIR = "snapshot"
+
+# Memory the CSV parser may use at once while streaming a source in (see read_chunks)
+INGEST_BUDGET = 256 * 2**20
+SAMPLE_ROWS = 1_000
+PARSE_OVERHEAD = 3  # the tokenizer buffers and the compacted copy, on top of the parsed chunk itself
+
+DATA_DATE_COLUMNS = ["registration_date", "start_date", "end_date"]
+PROJECTS_DATE_COLUMNS = ["start_date", "completion_date"]
+
+# Compact in-memory schema. Low-cardinality strings are categoricals, numbers use the
+# smallest width their values fit in, and dates are int32 day offsets from 1970-01-01
+# (DAY_NA for a missing date). decode() turns a handful of rows back into plain pandas
+# dtypes for display. Integer columns get the width of the schema when their values fit
+# in it, int64 otherwise (see cast_column), and the snapshot manifest records which.
+DAY_NA = np.iinfo(np.int32).min
+
+DATA_SCHEMA = {
+    'ecn': 'int64',  # 15 digits
+    'pid': 'int32',
+    'registration_date': 'int32',
+    'start_date': 'int32',
+    'end_date': 'int32',
+    'version': 'category',
+    'area': 'category',
+    'contract_amount': 'int32',
+    'annual_amount': 'int32',
+    'property_type': 'category',
+    'property_subtype': 'category',
+    'property_size': 'float32',
+    'usage': 'category',
+    'nearest_metro': 'category',
+    'nearest_mall': 'category',
+    'project': 'category',
+}
+
+PROJECTS_SCHEMA = {
+    'project_name': 'category',
+    'developer_name': 'category',
+    'start_date': 'int32',
+    'completion_date': 'int32',
+    'area': 'category',
+    'total_units': 'float32',
+    'lat': 'float64',
+    'long': 'float64',
+}
+
+
+# datetime64 -> int32 days since 1970-01-01, and back
+def encode_dates(values):
+    dates = pd.to_datetime(values).to_numpy().astype('datetime64[D]')
+    return np.where(np.isnat(dates), DAY_NA, dates.astype('int64')).astype('int32')
+
+def decode_dates(days):
+    days = np.asarray(days)
+    dates = days.astype('int64').astype('datetime64[D]').astype('datetime64[ns]')
+    dates[days == DAY_NA] = np.datetime64('NaT')
+    return dates
+
+# Sizes are float32 in memory, rounded back to the 2 decimals they come with
+def decode_sizes(sizes):
+    return np.round(np.asarray(sizes, dtype = 'float64'), 2)
+
+def is_date_column(column):
+    return column in DATA_DATE_COLUMNS + PROJECTS_DATE_COLUMNS
+
+# The dtypes a column of the schema may have in memory: an integer column is widened
+# to int64 when its values don't fit in the schema width
+def column_dtypes(column, dtype):
+    if dtype.startswith('int') and not is_date_column(column):
+        return {dtype, 'int64'}
+    return {dtype}
+
+def cast_column(values, column, dtype):
+    if dtype == 'category':
+        return values.astype('category')
+    if is_date_column(column) and not pd.api.types.is_integer_dtype(values):
+        return encode_dates(values)
+    if 'int64' in column_dtypes(column, dtype):
+        limits = np.iinfo(dtype)
+        if len(values) and (values.min() < limits.min or values.max() > limits.max):
+            dtype = 'int64'
+    return values.astype(dtype)
+
+def apply_schema(frame, schema):
+    missing = [column for column in schema if column not in frame.columns]
+    if missing:
+        raise ValueError(f"Columns missing from the source: {', '.join(missing)}")
+    for column, dtype in schema.items():
+        frame[column] = cast_column(frame[column], column, dtype)
+    return frame
+
+def validate_schema(frame, schema):
+    wrong = [f"{column} ({frame[column].dtype if column in frame.columns else 'missing'}, expected {dtype})"
+             for column, dtype in schema.items()
+             if column not in frame.columns or str(frame[column].dtype) not in column_dtypes(column, dtype)]
+    if wrong:
+        raise ValueError(f"Data doesn't match the schema: {', '.join(wrong)}")
+    return frame
+
+# Plain pandas dtypes for a few rows going to the page: real dates, object strings
+# (so fillna("Missing Data") works) and sizes with 2 decimals
+def decode(frame):
+    for column in frame.columns:
+        if is_date_column(column) and pd.api.types.is_integer_dtype(frame[column]):
+            frame[column] = decode_dates(frame[column])
+        elif isinstance(frame[column].dtype, pd.CategoricalDtype):
+            frame[column] = frame[column].astype(object)
+        elif column == 'property_size':
+            frame[column] = decode_sizes(frame[column])
+    return frame
+
+
+# Opening a local file or a remote URL and returning the whole content
+def read_source(source):
+    with open_source(source) as f:
+        return f.read()
+
+def open_source(source):
+    if str(source).startswith(("http://", "https://")):
+        return urllib.request.urlopen(source)
+    return open(source, "rb")
+
+def is_local(source):
+    return not str(source).startswith(("http://", "https://"))
+
+def lowercase_columns(frame):
+    lowercase = lambda x: str(x).lower()
+    frame.rename(lowercase, axis = 'columns', inplace = True)
+    return frame
+
+# Parsing the rent contracts CSV, the same way the app always did, then compacting it
+def parse_data_csv(raw):
+    data = pd.read_csv(io.BytesIO(raw), sep = ',', parse_dates = DATA_DATE_COLUMNS)
+    lowercase_columns(data)
+    return apply_schema(data, DATA_SCHEMA)
+
+def parse_projects_csv(raw):
+    projects = pd.read_csv(io.BytesIO(raw), sep = ',', parse_dates = PROJECTS_DATE_COLUMNS)
+    lowercase_columns(projects)
+    return apply_schema(projects, PROJECTS_SCHEMA)
+
+PARSERS = {
+    "data": parse_data_csv,
+    "projects": parse_projects_csv,
+}
+
+SCHEMAS = {
+    "data": DATA_SCHEMA,
+    "projects": PROJECTS_SCHEMA,
+}
+
+
+class HashingReader:
+    """File-like wrapper hashing and counting the bytes the CSV parser reads through it."""
+
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size = -1):
+        block = self.f.read(size)
+        self.sha256.update(block)
+        self.size += len(block)
+        return block
+
+    def __iter__(self):
+        return iter(lambda: self.readline(), b"")
+
+    def readline(self, size = -1):
+        line = self.f.readline(size)
+        self.sha256.update(line)
+        self.size += len(line)
+        return line
+
+# Rows per chunk so that parsing one chunk stays within `budget`, from the size of a parsed sample
+def chunk_rows(sample, budget):
+    row_bytes = sample.memory_usage(index = False, deep = True).sum() / max(len(sample), 1)
+    return max(int(budget / (PARSE_OVERHEAD * max(row_bytes, 1))), SAMPLE_ROWS)
+
+# Keeping the rows of the given areas (and registered on or after `since`), in the compact schema
+def compact_chunk(chunk, schema, areas = None, since = None):
+    lowercase_columns(chunk)
+    if areas is not None:
+        chunk = chunk[chunk['area'].isin(areas)]
+    chunk = apply_schema(chunk.copy(), schema)
+    if since is not None:
+        chunk = chunk[chunk['registration_date'].to_numpy() >= since]
+    # no categories of the rows filtered out (Arrow's dictionaries hold every value of the range)
+    return chunk.assign(**{column: chunk[column].cat.remove_unused_categories()
+                           for column, dtype in schema.items() if dtype == 'category'})
+
+# Streaming the CSV in chunks sized to the memory budget. Only the schema columns are parsed,
+# each chunk is filtered and compacted before the next one is read. Yields the compact chunks.
+def read_chunks(f, schema, budget = INGEST_BUDGET, areas = None, since = None):
+    wanted = lambda column: column.lower() in schema
+    with pd.read_csv(f, sep = ',', usecols = wanted, iterator = True) as reader:
+        sample = reader.get_chunk(SAMPLE_ROWS)
+        rows = chunk_rows(sample, budget)
+        yield compact_chunk(sample, schema, areas, since)
+        while True:
+            try:
+                chunk = reader.get_chunk(rows)
+            except StopIteration:
+                return
+            yield compact_chunk(chunk, schema, areas, since)
+
+# Smallest signed integer type for the codes of `n` categories (and -1 for missing)
+def code_dtype(n):
+    return np.result_type(np.min_scalar_type(-n), np.int8)
+
+class ChunkedFrame:
+    """Output of the chunked pipeline. Numeric columns are kept as lists of arrays and categoricals
+    as lists of codes against one growing category list per column, so no chunk keeps its own
+    copy of the category strings."""
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.pieces = {column: [] for column in schema}
+        self.categories = {column: pd.Index([], dtype = object) for column, dtype in schema.items() if dtype == 'category'}
+        self.rows = 0
+
+    def append(self, chunk):
+        for column in self.schema:
+            values = chunk[column].array
+            if column in self.categories:
+                known = self.categories[column]
+                known = known.append(values.categories.difference(known))
+                self.categories[column] = known
+                recode = np.append(known.get_indexer(values.categories), -1).astype(code_dtype(len(known)))
+                self.pieces[column].append(recode[values.codes])  # code -1 (missing) stays -1
+            else:
+                self.pieces[column].append(np.asarray(values))
+        self.rows += len(chunk)
+
+    # One frame, column by column, each column's pieces are dropped as soon as it's built.
+    # Categories end up sorted, like a categorical built from the whole column at once.
+    def to_frame(self):
+        columns = {}
+        for column, dtype in self.schema.items():
+            pieces = self.pieces.pop(column)
+            values = np.concatenate(pieces) if pieces else np.empty(0, np.int32 if column in self.categories else dtype)
+            del pieces
+            if column in self.categories:
+                categories = self.categories[column]
+                order = categories.argsort()
+                rank = np.append(np.argsort(order), -1).astype(np.int32)
+                values = pd.Categorical.from_codes(rank[values], categories = categories[order])
+            columns[column] = values
+        return pd.DataFrame(columns, copy = False)  # no consolidation, that would copy the numeric columns again
+
+# Reading a whole source through the chunked pipeline, returns the frame and the source fingerprint.
+# The peak memory is the budget plus the compact output, not a multiple of the CSV size.
+def stream_csv(name, source, budget = INGEST_BUDGET, areas = None, since = None):
+    schema = SCHEMAS[name]
+    with open_source(source) as f:
+        reader = HashingReader(f)
+        output = ChunkedFrame(schema)
+        for chunk in read_chunks(reader, schema, budget, areas, since):
+            output.append(chunk)
+        # the parser may stop before the very end (trailing blank lines), the fingerprint covers it all
+        while reader.read(1 << 20):
+            pass
+    return output.to_frame(), source_fingerprint(source, reader.sha256.hexdigest(), reader.size)
+
+# The source as one compact frame with its fingerprint: parsed in parallel by `workers` processes
+# when it's a local file and workers are asked for, streamed in chunks otherwise
+def read_frame(name, source, budget = INGEST_BUDGET, areas = None, workers = None):
+    if workers and is_local(source):
+        import dtl_parallel  # builds on this module
+        return dtl_parallel.parse_parallel(name, source, workers, areas, budget)
+    return stream_csv(name, source, budget, areas)
+
+
+# Snapshot files: <name>.arrow (Arrow IPC) and <name>.json (manifest)
+def snapshot_paths(snapshot_dir, name):
+    return (os.path.join(snapshot_dir, f"{name}.arrow"),
+            os.path.join(snapshot_dir, f"{name}.json"))
+
+def frame_schema(frame):
+    return {column: str(dtype) for column, dtype in frame.dtypes.items()}
+
+def read_manifest(snapshot_dir, name):
+    _, manifest_path = snapshot_paths(snapshot_dir, name)
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_atomic(path, write):
+    tmp_path = f"{path}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def source_fingerprint(source, sha256, size):
+    return {
+        "source": str(source),
+        "source_sha256": sha256,
+        "source_size": size,
+        "source_mtime": os.path.getmtime(source) if is_local(source) else None,
+    }
+
+# Latest registration_date in the data (as a day offset), incremental ingest starts from it
+def watermark(frame):
+    if 'registration_date' not in frame.columns:
+        return None
+    days = frame['registration_date'].to_numpy()
+    days = days[days != DAY_NA]
+    return int(days.max()) if len(days) else None
+
+# `schema` with its integer fields widened to the ones of `other` where those are wider
+def widen_schema(schema, other):
+    for i, field in enumerate(schema):
+        wider = other.field(field.name).type if field.name in other.names else field.type
+        if pa.types.is_integer(field.type) and pa.types.is_integer(wider) and wider.bit_width > field.type.bit_width:
+            schema = schema.set(i, field.with_type(wider))
+    return schema
+
+def write_part(frame, path, schema = None):
+    table = pa.Table.from_pandas(frame, preserve_index = False)
+    if schema is not None:
+        table = table.cast(schema)
+    # Uncompressed, so the file can be memory-mapped and shared through the OS page cache
+    write_atomic(path, lambda tmp_path: feather.write_feather(table, tmp_path, compression = "uncompressed"))
+
+def write_manifest(manifest, snapshot_dir, name):
+    _, manifest_path = snapshot_paths(snapshot_dir, name)
+    write_atomic(manifest_path, lambda path: _dump_json(manifest, path))
+
+# Streaming the source in once and storing it as a typed snapshot with its manifest.
+# Only the rows of `areas` are kept when given (all of them by default).
+# Incremental parts appended since the last build are dropped, this is a full rebuild.
+def build_snapshot(name, source, snapshot_dir = SNAPSHOT_DIR, areas = None, budget = INGEST_BUDGET, workers = None):
+    if feather is None:
+        raise RuntimeError("pyarrow is required to build the data snapshot")
+
+    frame, fingerprint = read_frame(name, source, budget, areas, workers)
+
+    os.makedirs(snapshot_dir, exist_ok = True)
+    arrow_path, _ = snapshot_paths(snapshot_dir, name)
+    write_part(frame, arrow_path)
+
+    manifest = {
+        "name": name,
+        "version": SNAPSHOT_VERSION,
+        **fingerprint,
+        "areas": sorted(areas) if areas is not None else None,
+        "rows": len(frame),
+        "schema": frame_schema(frame),
+        "parts": [os.path.basename(arrow_path)],
+        "watermark": watermark(frame),
+        "amended": False,
+        "built_at": datetime.datetime.now().isoformat(timespec = "seconds"),
+    }
+    write_manifest(manifest, snapshot_dir, name)
+
+    for part in glob.glob(os.path.join(snapshot_dir, f"{name}.delta-*.arrow")):
+        os.remove(part)
+    return frame
+
+# Contracts from `source` registered on or after the snapshot watermark.
+# Contracts registered on the watermark day itself may be known already, the caller
+# sorts out which of them are new, amended or unchanged.
+def read_delta(source, since, areas = None, budget = INGEST_BUDGET):
+    delta, fingerprint = stream_csv("data", source, budget, areas, since)
+    return delta.drop_duplicates().reset_index(drop = True), fingerprint
+
+# Adding new and amended contracts to the snapshot as one more Arrow part.
+# Amended contracts supersede their older rows, those are dropped on the next read.
+# A delta with integers wider than the snapshot's widens them in the manifest schema.
+def append_snapshot(name, delta, snapshot_dir = SNAPSHOT_DIR, amended = False, fingerprint = None):
+    manifest = read_manifest(snapshot_dir, name)
+    base_path = os.path.join(snapshot_dir, manifest["parts"][0])
+    part = f"{name}.delta-{len(manifest['parts']):04d}.arrow"
+    schema = widen_schema(feather.read_table(base_path, memory_map = True).schema,
+                          pa.Schema.from_pandas(delta, preserve_index = False))
+    write_part(delta, os.path.join(snapshot_dir, part), schema)
+
+    for column, dtype in frame_schema(delta).items():
+        if dtype == 'int64' and column in manifest["schema"]:
+            manifest["schema"][column] = dtype
+    manifest["parts"].append(part)
+    manifest["rows"] += len(delta)
+    manifest["amended"] = manifest["amended"] or amended
+    delta_watermark = watermark(delta)
+    if delta_watermark is not None:
+        manifest["watermark"] = max(manifest["watermark"] or delta_watermark, delta_watermark)
+    if fingerprint is not None and fingerprint["source"] == manifest["source"]:
+        manifest.update(fingerprint)  # the source as it is now is fully in the snapshot
+    manifest["updated_at"] = datetime.datetime.now().isoformat(timespec = "seconds")
+    write_manifest(manifest, snapshot_dir, name)
+    return manifest
+
+def _dump_json(obj, path):
+    with open(path, "w") as f:
+        json.dump(obj, f, indent = 2)
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# The snapshot is stale when it was built by another version, from another source or for
+# other areas, or (for local files) the source content has changed since.
+# Remote sources can't be checked without downloading them, those are rebuilt explicitly.
+def is_fresh(manifest, source, areas = None):
+    if manifest is None:
+        return False
+    if manifest.get("version") != SNAPSHOT_VERSION or manifest.get("source") != str(source):
+        return False
+    if manifest.get("areas") != (sorted(areas) if areas is not None else None):
+        return False
+    if not is_local(source):
+        return True
+    if not os.path.exists(source):
+        return True  # the last good copy is better than nothing
+    if (os.path.getsize(source) == manifest.get("source_size")
+            and os.path.getmtime(source) == manifest.get("source_mtime")):
+        return True
+    return file_sha256(source) == manifest.get("source_sha256")
+
+# Keeping only the rows of each contract (ecn, version) from the last part it appears in.
+# Grouped by the version codes, groupby would leave out the contracts without a version (code -1).
+def drop_superseded(frame, part_rows):
+    part = np.repeat(np.arange(len(part_rows)), part_rows)
+    version = pd.Categorical(frame['version']).codes
+    last_part = pd.Series(part).groupby([frame['ecn'].to_numpy(), version]).transform('max')
+    return frame[part == last_part.to_numpy()].reset_index(drop = True)
+
+def read_snapshot(name, snapshot_dir = SNAPSHOT_DIR):
+    manifest = read_manifest(snapshot_dir, name)
+    # Memory-mapped and split into one block per column, so numeric columns
+    # stay zero-copy views on the mapped file instead of being copied into the heap.
+    # Incremental parts are cast to the base part schema (dictionary index widths may differ),
+    # with the integers widened where a part has wider ones.
+    tables = [feather.read_table(os.path.join(snapshot_dir, part), memory_map = True) for part in manifest["parts"]]
+    schema = tables[0].schema
+    for t in tables[1:]:
+        schema = widen_schema(schema, t.schema)
+    table = tables[0] if len(tables) == 1 else pa.concat_tables([t.cast(schema) for t in tables])
+    frame = table.to_pandas(split_blocks = True)
+    if manifest["amended"]:
+        frame = drop_superseded(frame, [t.num_rows for t in tables])
+
+    # the widths the manifest recorded, and those have to be ones the schema allows
+    if frame_schema(frame) != manifest["schema"]:
+        raise ValueError(f"Snapshot {manifest['parts'][0]} doesn't match its manifest schema")
+    return validate_schema(frame, SCHEMAS[name])
+
+# Loading from the snapshot when it's there and fresh, otherwise from the CSV.
+# A stale snapshot is rebuilt on the way, so the next start is fast again.
+def load(name, source, snapshot_dir = SNAPSHOT_DIR, areas = None, budget = INGEST_BUDGET, workers = None):
+    if feather is None:
+        return read_frame(name, source, budget, areas, workers)[0]
+
+    if is_fresh(read_manifest(snapshot_dir, name), source, areas):
+        try:
+            return read_snapshot(name, snapshot_dir)
+        except (OSError, ValueError, KeyError, TypeError, pa.ArrowException):
+            pass  # broken snapshot, rebuilding it below
+
+    try:
+        build_snapshot(name, source, snapshot_dir, areas, budget, workers)
+        return read_snapshot(name, snapshot_dir)
+    except OSError:
+        # read-only disk, parsing the CSV and serving it as is
+        return read_frame(name, source, budget, areas, workers)[0]
+
+def load_data(source, snapshot_dir = SNAPSHOT_DIR, areas = None, budget = INGEST_BUDGET, workers = None):
+    return load("data", source, snapshot_dir, areas, budget, workers)
+
+def load_projects(source, snapshot_dir = SNAPSHOT_DIR, areas = None, budget = INGEST_BUDGET, workers = None):
+    return load("projects", source, snapshot_dir, areas, budget, workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Dubai Tenancy Lookup data snapshot")
+    commands = parser.add_subparsers(dest = "command", required = True)
+
+    build = commands.add_parser("build", help = "parse the CSV files and (re)build the snapshot")
+    build.add_argument("--data", help = "rent contracts CSV (path or URL)")
+    build.add_argument("--projects", help = "projects CSV (path or URL)")
+    build.add_argument("--snapshot-dir", default = SNAPSHOT_DIR)
+    build.add_argument("--areas", nargs = "+", help = "keep only the contracts and projects of these areas")
+    build.add_argument("--budget-mb", type = int, default = INGEST_BUDGET // 2**20, help = "parser memory budget")
+    build.add_argument("--workers", type = int, help = "parse local files with this many processes")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        for name, source in (("data", args.data), ("projects", args.projects)):
+            if source:
+                frame = build_snapshot(name, source, args.snapshot_dir, args.areas, args.budget_mb * 2**20, args.workers)
+                print(f"{name}: {len(frame):,} rows -> {snapshot_paths(args.snapshot_dir, name)[0]}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""Read-only dataset shared by all sessions of the app.
+
+The contracts, the projects and everything derived from them (indexes, building
+cube) are loaded once per server process and handed to every session as is.
+A session only holds a reference to it, never a copy. New contracts don't change
+it either: an ingest builds the next dataset, published with one assignment.
+"""
+import copy
+import itertools
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+import dtl_data
+import dtl_index
+import dtl_projects
+import dtl_sketch
+import dtl_stats
+
+# Every dataset loaded, and every delta ingested into one, gets a new version number (see Dataset.version)
+VERSIONS = itertools.count(1)
+
+# Rebuilding the frame over read-only views of its columns, so nothing can write
+# into the shared data by accident ("assignment destination is read-only").
+# Columns coming from the memory-mapped snapshot are read-only already.
+# Object columns are left alone, pandas can't compare read-only object arrays.
+def freeze(frame):
+    columns = {}
+    for column in frame.columns:
+        values = frame[column]
+        if isinstance(values.dtype, np.dtype) and values.dtype != object:
+            values = values.to_numpy().view()
+            values.flags.writeable = False
+        columns[column] = values
+    return pd.DataFrame(columns, index = frame.index, copy = False)
+
+# Copying the given rows out of a shared frame, column by column, decoded for display.
+# frame.iloc[...] would consolidate the shared frame in place (copying it into the
+# heap, writable again) before taking the rows, this leaves it untouched.
+def take_columns(frame, positions):
+    return pd.DataFrame({column: frame[column].array.take(positions) for column in frame.columns})
+
+def take_rows(frame, positions):
+    return dtl_data.decode(take_columns(frame, positions))
+
+# A new frame with the rows of `delta` after the rows of `frame`,
+# categoricals keep their codes and get the new categories appended
+def append_rows(frame, delta):
+    columns = {}
+    for column in frame.columns:
+        values, more = frame[column].array, delta[column].array
+        if isinstance(values, pd.Categorical):
+            columns[column] = union_categoricals([values, more])
+        else:
+            columns[column] = np.concatenate((np.asarray(values), np.asarray(more)))
+    return pd.DataFrame(columns)
+
+# Comparable set of rows, NaN replaced by None so equal rows compare equal
+def row_set(frame):
+    frame = frame.astype(object).where(frame.notna(), None)
+    return set(frame.itertuples(index = False, name = None))
+
+
+class Dataset:
+    """Contracts, projects and their indexes, built once and never modified (see ingest)."""
+
+    def __init__(self, data, projects, snapshot_dir = None, areas = None):
+        self.data = freeze(data)
+        self.projects = freeze(projects)
+        self.index = dtl_index.DataIndex(self.data).freeze()
+        self.cube = dtl_stats.BuildingCube(self.data)
+        self.sketches = dtl_sketch.SegmentSketches(self.data)
+        self.rent_index = dtl_stats.RentIndex(self.data)
+        self.spatial = dtl_index.SpatialIndex(self.projects)
+        self.project_dimension = dtl_projects.ProjectDimension(self.projects, self.data)
+        self.snapshot_dir = snapshot_dir
+        self.areas = areas
+        # changes whenever the data does, anything derived from it and cached elsewhere is keyed by it
+        self.version = (dtl_data.SNAPSHOT_VERSION, next(VERSIONS))
+
+    def rows(self, positions):
+        return take_rows(self.data, positions)
+
+    # Splitting the delta into new contracts, amended ones (keeping the rows they supersede)
+    # and contracts that are already known as they are, by (ecn, version). Grouped by the
+    # version codes, so contracts without a version (code -1) are a group like the others.
+    def classify(self, delta):
+        keep = np.ones(len(delta), dtype = bool)
+        superseded = []
+        new = amended = 0
+        versions = delta['version'].array
+        keys = pd.DataFrame({'ecn': delta['ecn'].to_numpy(), 'version': versions.codes})
+        for (ecn, code), group in keys.groupby(['ecn', 'version'], sort = False).indices.items():
+            rows = self.index.ecn_rows(ecn)
+            known = self.data['version'].array.take(rows)
+            rows = rows[pd.isna(known) if code < 0 else np.asarray(known) == versions.categories[code]]
+            if len(rows) == 0:
+                new += 1
+            elif row_set(take_columns(self.data, rows)) != row_set(delta.iloc[group].reset_index(drop = True)):
+                amended += 1
+                superseded.extend(rows)
+            else:
+                keep[group] = False
+        return delta[keep].reset_index(drop = True), np.asarray(superseded, dtype = np.intp), new, amended
+
+    # Incremental ingest: only contracts registered since the watermark (latest registration_date)
+    # are appended, to the snapshot as one more part and to copies of the data, indexes and cube.
+    # This dataset stays as it is for the sessions still using it. Returns the next dataset (this
+    # one when nothing changed) with the number of new and amended contracts.
+    def ingest(self, source):
+        manifest = dtl_data.read_manifest(self.snapshot_dir, "data") if self.snapshot_dir else None
+        since = manifest["watermark"] if manifest else dtl_data.watermark(self.data)
+        delta, fingerprint = dtl_data.read_delta(source, since, self.areas)
+        delta, superseded, new, amended = self.classify(delta)
+        if len(delta) == 0:
+            return self, 0, 0
+
+        offset = len(self.data)
+        data = freeze(append_rows(self.data, delta))
+        index = self.index.copy()
+        touched = index.remove(data, superseded) | index.extend(data, delta, offset)
+        index.freeze()
+        cube = self.cube.copy()
+        cube.update(data, index, touched)
+        sketches = self.sketches.copy()
+        sketches.subtract(take_columns(self.data, superseded))
+        sketches.add(delta)
+        # every row the index still knows is live, the superseded ones aren't
+        changed = np.concatenate((superseded, np.arange(offset, len(data))))
+        rent_index = self.rent_index.copy()
+        rent_index.update(data, index.ecn_order, changed)
+        project_dimension = self.project_dimension.copy()
+        project_dimension.update(data)
+
+        # the snapshot part last, a delta that failed to build is read again by the next ingest
+        if manifest:
+            dtl_data.append_snapshot("data", delta, self.snapshot_dir, amended = amended > 0, fingerprint = fingerprint)
+
+        dataset = copy.copy(self)
+        dataset.data, dataset.index, dataset.cube, dataset.sketches = data, index, cube, sketches
+        dataset.rent_index, dataset.project_dimension = rent_index, project_dimension
+        dataset.version = (dtl_data.SNAPSHOT_VERSION, next(VERSIONS))
+        return dataset, new, amended
+
+    @classmethod
+    def load(cls, data_source, projects_source, snapshot_dir = dtl_data.SNAPSHOT_DIR, areas = None,
+             budget = dtl_data.INGEST_BUDGET, workers = None):
+        data = dtl_data.load_data(data_source, snapshot_dir, areas, budget, workers)
+        projects = dtl_data.load_projects(projects_source, snapshot_dir, areas, budget, workers)
+        return cls(data, projects, snapshot_dir, areas)
+
+
+class LiveDataset:
+    """The current dataset of the app, replaced as a whole by each ingest.
+
+    A session takes `current` once per rerun and keeps using that dataset, an ingest
+    publishes the next one with a single assignment. Ingests run one at a time, so two
+    of them never read the same watermark and append the same delta twice.
+    """
+
+    def __init__(self, dataset):
+        self.current = dataset
+        self.lock = threading.Lock()
+
+    # Returns the number of new and amended contracts
+    def ingest(self, source):
+        with self.lock:
+            self.current, new, amended = self.current.ingest(source)
+        return new, amended
+
+
+def frame_bytes(frame):
+    return int(frame.memory_usage(index = True, deep = True).sum())
+
+# Resident set size of this process, Linux only (None elsewhere)
+def resident_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+# Memory of the shared dataset, what each session costs is measured by dtl_bench.py (session_memory)
+def memory_report(dataset):
+    tables = frame_bytes(dataset.data) + frame_bytes(dataset.projects)
+    mapped = 0
+    if dataset.snapshot_dir:
+        for name in ("data", "projects"):
+            arrow_path, _ = dtl_data.snapshot_paths(dataset.snapshot_dir, name)
+            if os.path.exists(arrow_path):
+                mapped += os.path.getsize(arrow_path)
+
+    return {
+        "rows": len(dataset.data),
+        "table_bytes": tables,
+        "index_bytes": dataset.index.nbytes + dataset.spatial.nbytes + dataset.project_dimension.nbytes,
+        "cube_bytes": frame_bytes(dataset.cube.sizes) + frame_bytes(dataset.cube.totals) + dataset.sketches.nbytes
+                      + dataset.rent_index.nbytes,
+        "mapped_snapshot_bytes": mapped,
+        "process_resident_bytes": resident_bytes(),
+    }
@@ -0,0 +1,244 @@
+"""Local download cache of the remote CSV sources.
+
+Every remote source (DATA_URL, DATA_URL_PROJECTS) is kept on disk with a small
+JSON sidecar holding its ETag, Last-Modified and SHA-256. Revalidating it is a
+conditional GET (If-None-Match/If-Modified-Since): a 304 costs one round trip.
+When the server sends neither validator, the file is downloaded again and kept
+only if its hash changed, so the snapshot built from it stays fresh otherwise.
+
+Downloads go to a `.part` file first and replace the cached copy atomically
+once complete. An interrupted one is resumed with a Range request (If-Range on
+its validator, the server starts over when the file has changed meanwhile).
+
+The app serves the last good copy straight away and revalidates it in a
+background thread. Anything that speaks HTTP works as the server, a local
+stand-in included:
+
+    python -m http.server 8000 --directory bench_data/100000
+    python dtl_download.py fetch http://localhost:8000/data.csv
+
+http.server sends no ETag and ignores Range, so it only exercises the
+no-validator path. The stand-in of tests/test_download.py covers revalidation,
+resume and the background refresh as well.
+"""
+import argparse
+import datetime
+import email.utils
+import hashlib
+import http.client
+import json
+import os
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+
+DOWNLOAD_DIR = "downloads"
+BLOCK = 1 << 20
+TIMEOUT = 60  # seconds without a byte from the server
+
+
+def is_remote(source):
+    return str(source).startswith(("http://", "https://"))
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec = "seconds")
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_json(obj, path):
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(obj, f, indent = 2)
+    os.replace(f"{path}.tmp", path)
+
+
+class DownloadCache:
+    """Cached copies of remote files, revalidated and resumed with plain HTTP."""
+
+    def __init__(self, cache_dir = DOWNLOAD_DIR, timeout = TIMEOUT):
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.locks = {}  # one download of a URL at a time
+        self.lock = threading.Lock()
+        self.refreshes = {}
+
+    # Cached copy, its sidecar and the partial download of a URL. The file keeps
+    # the URL's file name, prefixed by a hash of the URL so two sources never clash.
+    def paths(self, url):
+        name = os.path.basename(urllib.parse.urlsplit(url).path) or "index"
+        key = hashlib.sha256(url.encode()).hexdigest()[:12]
+        path = os.path.join(self.cache_dir, f"{key}-{name}")
+        return path, f"{path}.json", f"{path}.part"
+
+    def meta(self, url):
+        path, meta_path, _ = self.paths(url)
+        meta = _read_json(meta_path)
+        return meta if meta is not None and os.path.exists(path) else None
+
+    def url_lock(self, url):
+        with self.lock:
+            return self.locks.setdefault(url, threading.Lock())
+
+    # Revalidating (downloading when needed) the copy of `url`, returns its local path.
+    # Local paths are returned as they are.
+    def fetch(self, url):
+        if not is_remote(url):
+            return url
+        os.makedirs(self.cache_dir, exist_ok = True)
+        with self.url_lock(url):
+            self.download(url)
+        return self.paths(url)[0]
+
+    # The last good copy when there is one (revalidated in the background, `on_change(path)`
+    # called when a newer one has replaced it), otherwise downloading it first
+    def local(self, url, on_change = None):
+        if not is_remote(url):
+            return url
+        if self.meta(url) is None:
+            return self.fetch(url)
+        self.refresh(url, on_change)
+        return self.paths(url)[0]
+
+    # Revalidating in a background thread, at most one at a time per URL
+    def refresh(self, url, on_change = None):
+        with self.lock:
+            running = self.refreshes.get(url)
+            if running is not None and running.is_alive():
+                return running
+            thread = threading.Thread(target = self._refresh, args = (url, on_change), daemon = True,
+                                      name = f"refresh {url}")
+            self.refreshes[url] = thread
+        thread.start()
+        return thread
+
+    def _refresh(self, url, on_change):
+        try:
+            with self.url_lock(url):
+                changed = self.download(url)
+        except (OSError, ValueError, http.client.HTTPException) as error:
+            meta = self.meta(url)
+            if meta is not None:
+                meta["last_error"] = f"{_now()} {error}"
+                _write_json(meta, self.paths(url)[1])
+            return  # the last good copy stays in use
+        if changed and on_change is not None:
+            on_change(self.paths(url)[0])
+
+    # One conditional (or resumed) GET of `url` into the cache. True when the cached copy changed.
+    def download(self, url):
+        path, meta_path, part_path = self.paths(url)
+        meta, partial = self.meta(url), _read_json(f"{part_path}.json")
+        offset = os.path.getsize(part_path) if partial is not None and os.path.exists(part_path) else 0
+
+        headers = {}
+        if offset and (partial.get("etag") or partial.get("last_modified")):
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = partial.get("etag") or partial.get("last_modified")
+        elif meta is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        try:
+            response = urllib.request.urlopen(urllib.request.Request(url, headers = headers), timeout = self.timeout)
+        except urllib.error.HTTPError as error:
+            if error.code == 304:
+                meta["checked_at"] = _now()
+                _write_json(meta, meta_path)
+                return False
+            if error.code == 416:  # the partial download is no use, starting over
+                self.discard_partial(url)
+                return self.download(url)
+            raise
+
+        with response:
+            resumed = response.status == 206
+            if resumed and not response.headers.get("Content-Range", "").startswith(f"bytes {offset}-"):
+                raise ValueError(f"{url} resumed at {response.headers.get('Content-Range')}, expected byte {offset}")
+            partial = {
+                "url": url,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            }
+            _write_json(partial, f"{part_path}.json")
+            sha256 = hashlib.sha256()
+            if resumed:
+                with open(part_path, "rb") as f:
+                    for block in iter(lambda: f.read(BLOCK), b""):
+                        sha256.update(block)
+            received = 0
+            with open(part_path, "ab" if resumed else "wb") as f:
+                for block in iter(lambda: response.read(BLOCK), b""):
+                    f.write(block)
+                    sha256.update(block)
+                    received += len(block)
+            # read(n) doesn't raise on a dropped connection, the .part is kept to resume from
+            expected = response.headers.get("Content-Length")
+            if expected is not None and received != int(expected):
+                raise http.client.IncompleteRead(b"", int(expected) - received)
+        return self.complete(url, partial, sha256.hexdigest())
+
+    # Moving a finished download in place, unless it's the same content as the cached copy
+    def complete(self, url, partial, sha256):
+        path, meta_path, part_path = self.paths(url)
+        meta = self.meta(url)
+        changed = meta is None or meta.get("sha256") != sha256
+        if changed:
+            os.replace(part_path, path)
+        else:
+            os.remove(part_path)  # the cached file (and its mtime) stays as it was
+        os.remove(f"{part_path}.json")
+        _write_json({
+            **partial,
+            "sha256": sha256,
+            "size": os.path.getsize(path),
+            "downloaded_at": _now() if changed else meta.get("downloaded_at"),
+            "checked_at": _now(),
+        }, meta_path)
+        return changed
+
+    def discard_partial(self, url):
+        _, _, part_path = self.paths(url)
+        for leftover in (part_path, f"{part_path}.json"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+    # When the copy of `url` was last downloaded and revalidated, for display
+    def status(self, url):
+        meta = self.meta(url) or {}
+        last_modified = meta.get("last_modified")
+        return {
+            "downloaded_at": meta.get("downloaded_at"),
+            "checked_at": meta.get("checked_at"),
+            "source_modified": (email.utils.parsedate_to_datetime(last_modified).isoformat()
+                                if last_modified else None),
+            "size": meta.get("size"),
+            "last_error": meta.get("last_error"),
+            "refreshing": url in self.refreshes and self.refreshes[url].is_alive(),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Dubai Tenancy Lookup download cache")
+    commands = parser.add_subparsers(dest = "command", required = True)
+
+    fetch = commands.add_parser("fetch", help = "download or revalidate the cached copy of URLs")
+    fetch.add_argument("urls", nargs = "+")
+    fetch.add_argument("--cache-dir", default = DOWNLOAD_DIR)
+
+    args = parser.parse_args()
+    if args.command == "fetch":
+        cache = DownloadCache(args.cache_dir)
+        for url in args.urls:
+            before = (cache.meta(url) or {}).get("sha256")
+            path = cache.fetch(url)
+            print(f"{url} -> {path} ({'changed' if cache.meta(url)['sha256'] != before else 'unchanged'})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""Ejari lookup engine.
+
+Everything the app shows for an Ejari number (ECN), without Streamlit: the
+property overview, its rent history, the building information and statistics.
+The same engine answers a whole file of ECNs at once:
+
+    python dtl_engine.py batch ecns.txt --data <DATA_URL> --projects <DATA_URL_PROJECTS> --output lookup.csv
+
+and reports how many contracts find their building in the projects file:
+
+    python dtl_engine.py coverage --data <DATA_URL> --projects <DATA_URL_PROJECTS>
+"""
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import dtl_data
+import dtl_dataset
+import dtl_index
+
+MISSING = "Missing Data"
+
+
+def has_contract(dataset, ecn):
+    return dataset.index.has_ecn(ecn)
+
+# All rows registered under the ECN, ready for display
+def contract_rows(dataset, ecn):
+    ecn_data = dataset.rows(dataset.index.ecn_rows(ecn))
+    ecn_data.fillna(MISSING, inplace = True)
+    return ecn_data
+
+def property_overview(ecn_data):
+    return {
+        "start_date": ecn_data['start_date'].min().strftime('%d %b %Y'),
+        "end_date": ecn_data['end_date'].max().strftime('%d %b %Y'),
+        "pid": ecn_data['pid'].iloc[0],
+        "area": ecn_data['area'].iloc[0],
+        "property_size": ecn_data['property_size'].iloc[0],
+        "usage": f"{ecn_data['usage'].iloc[0]}",
+        "project": f"{ecn_data['project'].iloc[0]}",
+        "property_type": f"{ecn_data['property_type'].iloc[0]}",
+        "property_subtype": f"{ecn_data['property_subtype'].iloc[0]}",
+        "nearest_metro": f"{ecn_data['nearest_metro'].iloc[0]}",
+        "nearest_mall": f"{ecn_data['nearest_mall'].iloc[0]}",
+    }
+
+# Every contract of the property, sorted by start_date
+def rent_history(dataset, pid):
+    return dataset.rows(dataset.index.pid_rows(pid))
+
+# The project location (for the map) and its description, (None, None) when the project is unknown.
+# Both come preformatted from the project dimension built at load, no scan of the projects.
+def project_overview(dataset, project):
+    record = dataset.project_dimension.get(project)
+    if record is None:
+        return None, None
+
+    lat, long = dataset.project_dimension.location(project)
+    project_dict = {field: MISSING if value is None else value for field, value in record.items()}
+    return pd.DataFrame({'lat': [lat], 'long': [long]}), project_dict
+
+# Per property size rows of the building, and the median/mean annual amount of the whole building
+def building_summary(dataset, project, usage):
+    sizes = dataset.cube.building_sizes(project, usage)
+    totals = dataset.cube.building_totals(project, usage)
+    if totals is None:
+        return sizes, np.nan, np.nan
+    return sizes, totals['median_amount'], totals['mean_amount']
+
+# Same for properties within +/- window sq.m of `size`
+def similar_summary(dataset, project, usage, size, window = 10):
+    sizes = dataset.cube.building_sizes(project, usage)
+    sizes = sizes[sizes['property_size'].between(size - window, size + window)]
+    amounts = dataset.data['annual_amount'].to_numpy()[dataset.index.similar_rows(project, usage, size, window)]
+    if len(amounts) == 0:
+        return sizes, np.nan, np.nan
+    return sizes, np.median(amounts), np.mean(amounts)
+
+# Contracts of the same usage and similar size (+/- window sq.m) that started in the last
+# `months` months of the data, in every building within `km` of the project (itself included).
+# One row per building with contracts, closest first, and the median/mean of all of them.
+# Buildings are found by their projects file name and their contracts by the contract project names
+# resolved to it (see dtl_projects.py), the project's own building keeps the name it was asked by.
+def comparable_rents(dataset, project, usage, size, km = 2, window = 10, months = 12):
+    dimension = dataset.project_dimension
+    record = dimension.get(project)
+    own = record['project_name'] if record is not None else None
+    names, distances = dataset.spatial.near_project(own, km)
+    # records normalized to the same key share their contracts, only the closest one of them counts
+    # (the project's own building, at 0 km, first)
+    order = np.argsort(names != own, kind = 'stable')
+    names, distances = names[order], distances[order]
+    first = ~pd.Series([dimension.key(name) for name in names], dtype = object).duplicated().to_numpy()
+    names, distances = names[first], distances[first]
+    rows = [np.concatenate([dtl_index.EMPTY] + [dataset.index.similar_rows(contract_project, usage, size, window)
+                                                for contract_project in dimension.contract_projects(name)])
+            for name in names]
+    names = np.where(names == own, project, names)
+    building = np.repeat(np.arange(len(names)), [len(r) for r in rows])
+    rows = np.concatenate(rows) if rows else dtl_index.EMPTY
+
+    cutoff = dataset.index.latest_start - int(months * 30.44)
+    recent = dataset.data['start_date'].to_numpy()[rows] >= cutoff
+    amounts = pd.Series(dataset.data['annual_amount'].to_numpy()[rows][recent], dtype = 'float64')
+    grouped = amounts.groupby(building[recent])
+
+    buildings = pd.DataFrame({
+        'contracts': grouped.count(),
+        'median_amount': grouped.median(),
+        'mean_amount': grouped.mean(),
+    })
+    buildings.insert(0, 'distance_km', distances[buildings.index].round(2))
+    buildings.insert(0, 'project', names[buildings.index])
+    buildings = buildings.reset_index(drop = True)
+    if len(amounts) == 0:
+        return buildings, np.nan, np.nan
+    return buildings, amounts.median(), amounts.mean()
+
+# Median annual amount of the building and of the area by month or quarter, one frame with a `series`
+# column, looked up in the precomputed rent index (no groupby over the contracts)
+def rent_index(dataset, project, usage, area, period = 'month'):
+    building = dataset.rent_index.series('building', project, usage, period)
+    building.insert(0, 'series', "Building")
+    area_index = dataset.rent_index.series('area', area, usage, period)
+    area_index.insert(0, 'series', "Area")
+    return pd.concat([building, area_index], ignore_index = True)
+
+FAIR_PRICE_SCOPES = ("size band", "building", "area")
+
+# Where `amount` ranks among the contracts of the same usage in the project's size band,
+# the whole building or the whole area, from the merged quantile sketches (see dtl_sketch.py)
+def fair_price(dataset, amount, project, usage, size, area = None, scope = "size band"):
+    sketches = dataset.sketches
+    if scope == "size band":
+        sketch = sketches.merged([project], usage, size)
+    elif scope == "building":
+        sketch = sketches.merged([project], usage)
+    elif scope == "area":
+        sketch = sketches.merged(sketches.area_projects(area), usage)
+    else:
+        raise ValueError(f"Unknown scope {scope}, expected one of {', '.join(FAIR_PRICE_SCOPES)}")
+
+    return {
+        "contracts": sketch.count,
+        "percentile": sketch.percentile(amount) * 100,
+        "median": sketch.quantile(0.5),
+        "q25": sketch.quantile(0.25),
+        "q75": sketch.quantile(0.75),
+    }
+
+# Rent history summary of each property (one row per PID)
+def history_summary(dataset, pids):
+    positions, _ = dtl_index.positions_for_many(dataset.index.pid_keys, dataset.index.pid_order, np.unique(pids))
+    history = dtl_dataset.take_columns(dataset.data, positions)[['pid', 'start_date', 'annual_amount']]
+    history['start_date'] = dtl_data.decode_dates(history['start_date'])
+    grouped = history.groupby('pid')
+    return pd.DataFrame({
+        'history_contracts': grouped['annual_amount'].count(),
+        'history_first_start': grouped['start_date'].min(),
+        'history_last_start': grouped['start_date'].max(),
+        'history_min_amount': grouped['annual_amount'].min(),
+        'history_median_amount': grouped['annual_amount'].median(),
+        'history_max_amount': grouped['annual_amount'].max(),
+    }).reset_index()
+
+# One row per (ECN, property) with the property overview, its rent history summary and the
+# building median/mean. All ECNs are matched at once against the sorted ECN index,
+# ECNs that aren't found get a row with found = False.
+def batch_lookup(dataset, ecns):
+    ecns = np.asarray(ecns, dtype = 'int64')
+    positions, query = dtl_index.positions_for_many(dataset.index.ecn_keys, dataset.index.ecn_order, ecns)
+
+    rows = dataset.rows(positions)
+    rows.insert(0, 'query', query)
+
+    history = history_summary(dataset, rows['pid'].to_numpy())
+    totals = dataset.cube.totals[['contracts', 'median_amount', 'mean_amount']].reset_index()
+    totals = totals.astype({'project': object, 'usage': object}).rename(columns = {
+        'contracts': 'building_contracts',
+        'median_amount': 'building_median_amount',
+        'mean_amount': 'building_mean_amount',
+    })
+
+    rows = rows.merge(history, on = 'pid', how = 'left').merge(totals, on = ['project', 'usage'], how = 'left')
+    queries = pd.DataFrame({'query': np.arange(len(ecns)), 'ecn': ecns})
+    result = queries.merge(rows.drop(columns = 'ecn'), on = 'query', how = 'left')
+    result.insert(2, 'found', result['pid'].notna())
+    return result.drop(columns = 'query').convert_dtypes()  # nullable ints, the unmatched ECNs have no pid
+
+def read_ecns(path):
+    ecns = pd.read_csv(path, header = None, names = ['ecn'], usecols = [0], dtype = str, comment = '#')['ecn'].str.strip()
+    return pd.to_numeric(ecns[ecns.str.isdigit()]).to_numpy()
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Dubai Tenancy Lookup batch engine")
+    commands = parser.add_subparsers(dest = "command", required = True)
+
+    batch = commands.add_parser("batch", help = "look up every ECN of a file (one per line)")
+    batch.add_argument("ecns", help = "file with one ECN per line")
+    batch.add_argument("--data", required = True, help = "rent contracts CSV (path or URL)")
+    batch.add_argument("--projects", required = True, help = "projects CSV (path or URL)")
+    batch.add_argument("--snapshot-dir", default = dtl_data.SNAPSHOT_DIR)
+    batch.add_argument("--output", default = "-", help = "CSV file to write, stdout by default")
+
+    coverage = commands.add_parser("coverage", help = "join coverage of the contract projects over the projects file")
+    coverage.add_argument("--data", required = True, help = "rent contracts CSV (path or URL)")
+    coverage.add_argument("--projects", required = True, help = "projects CSV (path or URL)")
+    coverage.add_argument("--snapshot-dir", default = dtl_data.SNAPSHOT_DIR)
+
+    args = parser.parse_args()
+    if args.command == "batch":
+        dataset = dtl_dataset.Dataset.load(args.data, args.projects, args.snapshot_dir)
+        ecns = read_ecns(args.ecns)
+
+        started = time.perf_counter()
+        result = batch_lookup(dataset, ecns)
+        elapsed = time.perf_counter() - started
+
+        result.to_csv(sys.stdout if args.output == "-" else args.output, index = False)
+        print(f"{len(ecns):,} contracts in {elapsed:.3f}s ({len(ecns) / max(elapsed, 1e-9):,.0f} contracts/s), "
+              f"{int(result['found'].sum()):,} rows found", file = sys.stderr)
+    elif args.command == "coverage":
+        dataset = dtl_dataset.Dataset.load(args.data, args.projects, args.snapshot_dir)
+        print(json.dumps(dataset.project_dimension.coverage, indent = 2))
+
+if __name__ == "__main__":
+    main()
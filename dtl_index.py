@@ -0,0 +1,263 @@
+"""Lookup indexes over the rent contracts and projects tables.
+
+Built once when the data is loaded, so a lookup by Ejari number, property ID,
+building or location doesn't have to scan the whole table on every rerun.
+"""
+import copy
+
+import numpy as np
+import pandas as pd
+
+EMPTY = np.empty(0, dtype = np.intp)
+EARTH_RADIUS_KM = 6371.0
+CELL_KM = 1.0
+
+
+# Sorted keys with the row positions in the same order, looked up with a binary search
+def sorted_positions(keys, *tiebreakers):
+    order = np.lexsort(tiebreakers[::-1] + (keys,))
+    return keys[order], order
+
+def positions_for(sorted_keys, order, key):
+    left = np.searchsorted(sorted_keys, key, side = 'left')
+    right = np.searchsorted(sorted_keys, key, side = 'right')
+    return order[left:right]
+
+# Row positions of many keys at once, with the index of the key each position belongs to
+def positions_for_many(sorted_keys, order, keys):
+    left = np.searchsorted(sorted_keys, keys, side = 'left')
+    right = np.searchsorted(sorted_keys, keys, side = 'right')
+    counts = right - left
+    query = np.repeat(np.arange(len(keys)), counts)
+    starts = np.repeat(left - np.cumsum(counts) + counts, counts)
+    return order[starts + np.arange(counts.sum())], query
+
+# Merging more (already sorted) keys in, O(n) copy instead of sorting everything again
+def insert_sorted(keys, order, new_keys, new_order):
+    at = np.searchsorted(keys, new_keys, side = 'right')
+    return np.insert(keys, at, new_keys), np.insert(order, at, new_order)
+
+# Where new rows go in the PID index, sorted by (pid, start_date). Each key is the position its PID
+# group starts at (rows of a PID not indexed yet come before the group they're inserted in front of)
+# and the start_date, in one int64, so a single binary search places every new row.
+def pid_insert_positions(pid_keys, starts, new_pids, new_starts):
+    if len(pid_keys) == 0:
+        return np.zeros(len(new_pids), dtype = np.intp)
+    rank = lambda days: np.asarray(days, dtype = np.int64) - np.iinfo(np.int32).min + 1  # DAY_NA -> 1
+    group = np.maximum.accumulate(np.where(np.r_[True, pid_keys[1:] != pid_keys[:-1]], np.arange(len(pid_keys)), 0))
+    keys = group.astype(np.int64) * 2**33 + rank(starts)
+    left = np.searchsorted(pid_keys, new_pids, side = 'left')
+    known = pid_keys[np.minimum(left, len(pid_keys) - 1)] == new_pids
+    new_keys = left.astype(np.int64) * 2**33 + np.where(known, rank(new_starts), 0)
+    return np.searchsorted(keys, new_keys, side = 'right')
+
+def delete_positions(keys, order, drop_keys, drop_positions):
+    at = []
+    for key, position in zip(drop_keys, drop_positions):
+        left = np.searchsorted(keys, key, side = 'left')
+        right = np.searchsorted(keys, key, side = 'right')
+        at.extend(left + np.flatnonzero(order[left:right] == position))
+    return np.delete(keys, at), np.delete(order, at)
+
+# Latest of int32 day offsets, missing days (the smallest int32) never win
+def latest_day(days):
+    return int(days.max()) if len(days) else np.iinfo(np.int32).min
+
+
+class DataIndex:
+    """Row positions of `data` by ECN, by PID (sorted by start_date) and by (project, usage) (sorted by property_size)."""
+
+    def __init__(self, data):
+        ecn = data['ecn'].to_numpy()
+        pid = data['pid'].to_numpy()
+        start_date = data['start_date'].to_numpy()
+        property_size = data['property_size'].to_numpy()
+
+        self.rows = len(data)
+        self.latest_start = latest_day(start_date)
+        self.ecn_keys, self.ecn_order = sorted_positions(ecn)
+        self.pid_keys, self.pid_order = sorted_positions(pid, start_date)
+        self.buildings = self.group_buildings(data['project'], data['usage'], property_size)
+
+    # (project, usage) -> (row positions, property sizes), both sorted by property_size.
+    # The arrays are slices of one building-ordered array, not copies.
+    @staticmethod
+    def group_buildings(project, usage, property_size):
+        project_codes, project_names = pd.factorize(project)
+        usage_codes, usage_names = pd.factorize(usage)
+        order = np.lexsort((property_size, usage_codes, project_codes))
+        sizes = property_size[order]
+        project_codes = project_codes[order]
+        usage_codes = usage_codes[order]
+
+        changes = np.flatnonzero((project_codes[1:] != project_codes[:-1]) | (usage_codes[1:] != usage_codes[:-1])) + 1
+        starts = np.concatenate(([0], changes))
+        stops = np.concatenate((changes, [len(order)]))
+
+        buildings = {}
+        for start, stop in zip(starts, stops):
+            if start == stop or project_codes[start] < 0 or usage_codes[start] < 0:
+                continue  # missing project or usage, those never make it to the building charts
+            key = (project_names[project_codes[start]], usage_names[usage_codes[start]])
+            buildings[key] = (order[start:stop], sizes[start:stop])
+        return buildings
+
+    # Indexing the rows of `delta`, appended to `data` at `offset` (incremental ingest).
+    # Returns the (project, usage) groups that got new rows.
+    def extend(self, data, delta, offset):
+        ecn_keys, ecn_order = sorted_positions(delta['ecn'].to_numpy())
+        self.ecn_keys, self.ecn_order = insert_sorted(self.ecn_keys, self.ecn_order, ecn_keys, ecn_order + offset)
+        # late registrations and amendments may start before the known contracts of their property,
+        # so new PID rows are placed by start_date too, not just after the others
+        pid_keys, pid_order = sorted_positions(delta['pid'].to_numpy(), delta['start_date'].to_numpy())
+        at = pid_insert_positions(self.pid_keys, data['start_date'].to_numpy()[self.pid_order],
+                                  pid_keys, delta['start_date'].to_numpy()[pid_order])
+        self.pid_keys, self.pid_order = np.insert(self.pid_keys, at, pid_keys), np.insert(self.pid_order, at, pid_order + offset)
+
+        buildings = self.group_buildings(delta['project'], delta['usage'], delta['property_size'].to_numpy())
+        for key, (rows, sizes) in buildings.items():
+            rows = rows + offset
+            if key in self.buildings:
+                rows = np.concatenate((self.buildings[key][0], rows))
+                sizes = np.concatenate((self.buildings[key][1], sizes))
+                order = np.argsort(sizes, kind = 'stable')
+                rows, sizes = rows[order], sizes[order]
+            self.buildings[key] = (rows, sizes)
+
+        self.rows = offset + len(delta)
+        self.latest_start = max(self.latest_start, latest_day(delta['start_date'].to_numpy()))
+        return set(buildings)
+
+    # Forgetting rows superseded by an amended contract, they stay in `data` but can't be found anymore.
+    # Returns the (project, usage) groups that lost rows.
+    def remove(self, data, positions):
+        positions = np.asarray(positions)
+        self.ecn_keys, self.ecn_order = delete_positions(self.ecn_keys, self.ecn_order, data['ecn'].to_numpy()[positions], positions)
+        self.pid_keys, self.pid_order = delete_positions(self.pid_keys, self.pid_order, data['pid'].to_numpy()[positions], positions)
+
+        touched = set(zip(np.asarray(data['project'].array.take(positions)), np.asarray(data['usage'].array.take(positions))))
+        touched &= set(self.buildings)
+        for key in touched:
+            rows, sizes = self.buildings[key]
+            keep = ~np.isin(rows, positions)
+            self.buildings[key] = (rows[keep], sizes[keep])
+        return touched
+
+    # A copy to build the next version of the dataset on. Updates replace the arrays, they never
+    # write into them, so only the dict of buildings needs copying.
+    def copy(self):
+        index = copy.copy(self)
+        index.buildings = dict(self.buildings)
+        return index
+
+    def arrays(self):
+        yield from (self.ecn_keys, self.ecn_order, self.pid_keys, self.pid_order)
+        for rows, sizes in self.buildings.values():
+            yield rows
+            yield sizes
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays())
+
+    # Shared between sessions, nobody is supposed to write into it
+    def freeze(self):
+        for array in self.arrays():
+            array.flags.writeable = False
+        return self
+
+    def has_ecn(self, ecn):
+        position = np.searchsorted(self.ecn_keys, ecn)
+        return position < len(self.ecn_keys) and self.ecn_keys[position] == ecn
+
+    def ecn_rows(self, ecn):
+        return positions_for(self.ecn_keys, self.ecn_order, ecn)
+
+    def pid_rows(self, pid):
+        return positions_for(self.pid_keys, self.pid_order, pid)
+
+    def building_rows(self, project, usage):
+        return self.buildings.get((project, usage), (EMPTY, None))[0]
+
+    # Rows of the building with property_size within +/- window sq.m
+    def similar_rows(self, project, usage, size, window = 10):
+        if (project, usage) not in self.buildings:
+            return EMPTY
+        rows, sizes = self.buildings[(project, usage)]
+        # bounds in the same float width as the sizes, so a size right on the edge still counts
+        left = np.searchsorted(sizes, sizes.dtype.type(size - window), side = 'left')
+        right = np.searchsorted(sizes, sizes.dtype.type(size + window), side = 'right')
+        return rows[left:right]
+
+
+# Great-circle distance in km from one point to many
+def haversine_km(lat, long, lats, longs):
+    lat, long, lats, longs = map(np.radians, (lat, long, lats, longs))
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((longs - long) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+class SpatialIndex:
+    """Grid of CELL_KM square cells over the project locations (lat/long).
+
+    Projects are sorted by cell key (row * 2**32 + column), so the cells of a query
+    are a handful of binary searches, one per grid row, and only the projects of
+    those cells get their distance computed.
+    """
+
+    def __init__(self, projects, cell_km = CELL_KM):
+        lat = projects['lat'].to_numpy(dtype = 'float64')
+        long = projects['long'].to_numpy(dtype = 'float64')
+        # one entry per project name, its first row, the one the building panel shows
+        names = pd.Series(np.asarray(projects['project_name'], dtype = object))
+        first = (names.notna() & ~names.duplicated(keep = 'first')).to_numpy()
+        located = np.flatnonzero(first & ~(np.isnan(lat) | np.isnan(long)))
+
+        # one degree of latitude is ~111 km everywhere, a degree of longitude shrinks with cos(lat)
+        self.cell_lat = cell_km / 111.32
+        middle = np.radians(np.median(lat[located])) if len(located) else 0.0
+        self.cell_long = cell_km / (111.32 * np.cos(middle))
+        self.cell_km = cell_km
+
+        self.lat, self.long = lat[located], long[located]
+        self.names = names.to_numpy()[located]
+        self.keys, self.order = sorted_positions(self.cell_keys(self.lat, self.long))
+        # project name -> its position in lat/long/names, for the reference building of a query
+        self.positions = {name: i for i, name in enumerate(self.names)}
+
+    def cell_keys(self, lat, long):
+        row = np.floor(lat / self.cell_lat).astype('int64')
+        column = np.floor(long / self.cell_long).astype('int64')
+        return row * 2**32 + column
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.lat, self.long, self.names, self.keys, self.order))
+
+    def location(self, name):
+        i = self.positions.get(name)
+        return None if i is None else (self.lat[i], self.long[i])
+
+    # Positions of the projects within `km` of (lat, long), closest first, with their distances
+    def near(self, lat, long, km):
+        reach = int(np.ceil(km / self.cell_km))
+        row = int(np.floor(lat / self.cell_lat))
+        column = int(np.floor(long / self.cell_long))
+        rows = np.arange(row - reach, row + reach + 1, dtype = 'int64')
+        left = np.searchsorted(self.keys, rows * 2**32 + column - reach, side = 'left')
+        right = np.searchsorted(self.keys, rows * 2**32 + column + reach, side = 'right')
+        candidates = np.concatenate([self.order[l:r] for l, r in zip(left, right)]) if len(rows) else EMPTY
+
+        distances = haversine_km(lat, long, self.lat[candidates], self.long[candidates])
+        within = distances <= km
+        candidates, distances = candidates[within], distances[within]
+        order = np.argsort(distances, kind = 'stable')
+        return candidates[order], distances[order]
+
+    # Names of the projects within `km` of the named project (itself included), with their distances
+    def near_project(self, name, km):
+        location = self.location(name)
+        if location is None:
+            return np.empty(0, dtype = object), np.empty(0)
+        positions, distances = self.near(*location, km)
+        return self.names[positions], distances
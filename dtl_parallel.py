@@ -0,0 +1,163 @@
+"""Parallel parsing of a local CSV source.
+
+The file is split into byte ranges that start and end on row boundaries, and
+every range is parsed, date-converted and compacted by its own worker of a
+process (or thread) pool. The ranges come back compact and are put together in
+order by the same ChunkedFrame as the streaming ingest (see dtl_data.py), so
+the result is the same frame, only sooner on a multi-core server.
+
+Rows are split on newlines: quoted fields with line breaks in them (none in
+the DLD files) need the streaming ingest.
+"""
+import codecs
+import collections
+import concurrent.futures
+import io
+import itertools
+import os
+
+import numpy as np
+import pandas as pd
+
+import dtl_data
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:  # parsed with pandas then
+    pa = None
+    pa_csv = None
+
+RANGES_PER_WORKER = 4
+EXECUTORS = {
+    "process": concurrent.futures.ProcessPoolExecutor,
+    "thread": concurrent.futures.ThreadPoolExecutor,
+}
+
+
+# Byte offsets [start, stop) of about `count` ranges of the file after the header line,
+# every boundary moved forward to the start of the next row
+def row_ranges(path, count):
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        header = f.readline()
+        first = f.tell()
+        header = header.removeprefix(codecs.BOM_UTF8)  # prepended to every range, the BOM doesn't belong there
+        boundaries = [first]
+        for offset in np.linspace(first, size, count + 1)[1:-1].astype(np.int64):
+            if offset <= boundaries[-1]:
+                continue
+            f.seek(offset - 1)
+            f.readline()  # the rest of the row the offset falls in (nothing when it's right after a newline)
+            if f.tell() < size and f.tell() > boundaries[-1]:
+                boundaries.append(f.tell())
+        boundaries.append(size)
+    return header, list(zip(boundaries[:-1], boundaries[1:]))
+
+MONTH_DAYS = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31], dtype = np.int32)
+
+# Days since 1970-01-01 of a proleptic Gregorian date, integer arithmetic only (H. Hinnant's days_from_civil)
+def days_from_civil(year, month, day):
+    year = year - (month <= 2)
+    era = np.floor_divide(year, 400)
+    year_of_era = year - era * 400
+    day_of_year = (153 * ((month + 9) % 12) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era - 719468
+
+# YYYY-MM-DD strings -> int32 days since 1970-01-01 (DAY_NA when missing), straight from the
+# digits. None when a value doesn't have that exact format, the caller falls back to pandas.
+def fast_dates(values):
+    text = np.asarray(values).astype("S11")  # one byte more to catch longer values, NaN becomes b"nan"
+    chars = np.frombuffer(text.tobytes(), dtype = np.uint8).reshape(-1, 11)
+    missing = (chars[:, 0] == 0) | (text == b"nan") | (text == b"None")
+    present = ~missing
+    if (chars[:, 10] != 0).any() or (chars[present, 9] == 0).any():
+        return None
+    if ((chars[present, 4] != ord("-")) | (chars[present, 7] != ord("-"))).any():
+        return None
+
+    digit = lambda i: np.where(present, chars[:, i].astype(np.int32) - ord("0"), 0)
+    year = digit(0) * 1000 + digit(1) * 100 + digit(2) * 10 + digit(3)
+    month = np.where(present, digit(5) * 10 + digit(6), 1)
+    day = np.where(present, digit(8) * 10 + digit(9), 1)
+    if ((month < 1) | (month > 12) | (day < 1) | (year < 0) | (year > 9999)).any():
+        return None
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    if (day > MONTH_DAYS[month - 1] + (leap & (month == 2))).any():
+        return None  # 2023-02-30 and the like, pandas rejects them and so does the fallback
+    return np.where(missing, dtl_data.DAY_NA, days_from_civil(year, month, day)).astype(np.int32)
+
+def date_columns(name):
+    return dtl_data.DATA_DATE_COLUMNS if name == "data" else dtl_data.PROJECTS_DATE_COLUMNS
+
+# Arrow's CSV reader (single-threaded, the pool is the parallelism): dates are read straight into
+# date32 (days since 1970-01-01) by its fixed-format ISO-8601 parser, strings into dictionaries
+def read_range_arrow(raw, header, name):
+    schema = dtl_data.SCHEMAS[name]
+    columns = {column.strip().strip('"'): column.strip().strip('"').lower()
+               for column in header.decode().rstrip("\r\n").split(",")}
+    wanted = [column for column, lower in columns.items() if lower in schema]
+    dates = {column: pa.date32() for column in wanted if columns[column] in date_columns(name)}
+    table = pa_csv.read_csv(io.BytesIO(raw),
+                            read_options = pa_csv.ReadOptions(use_threads = False),
+                            convert_options = pa_csv.ConvertOptions(include_columns = wanted, column_types = dates,
+                                                                    auto_dict_encode = True, strings_can_be_null = True))
+    chunk = {}
+    for column in wanted:
+        values = table.column(column)
+        if column in dates:
+            chunk[columns[column]] = values.cast(pa.int32()).to_numpy(zero_copy_only = False)
+            chunk[columns[column]] = np.where(values.is_null().to_numpy(zero_copy_only = False), dtl_data.DAY_NA, chunk[columns[column]])
+        else:
+            chunk[columns[column]] = values.to_pandas()
+    return pd.DataFrame(chunk)
+
+# pandas' CSV reader with the dates read as strings and converted by fast_dates
+def read_range_pandas(raw, name):
+    schema = dtl_data.SCHEMAS[name]
+    wanted = lambda column: column.lower() in schema
+    chunk = dtl_data.lowercase_columns(pd.read_csv(io.BytesIO(raw), sep = ',', usecols = wanted,
+                                                   dtype = {column: str for column in date_columns(name)}))
+    for column in date_columns(name):
+        days = fast_dates(chunk[column])
+        chunk[column] = days if days is not None else dtl_data.encode_dates(chunk[column])
+    return chunk
+
+# One byte range of the file, parsed and compacted (runs in a worker)
+def parse_range(path, header, start, stop, name, areas = None):
+    with open(path, "rb") as f:
+        f.seek(start)
+        raw = header + f.read(stop - start)
+
+    chunk = None
+    if pa_csv is not None:
+        try:
+            chunk = read_range_arrow(raw, header, name)
+        except (pa.ArrowInvalid, ValueError):
+            pass  # dates in another format, or values Arrow won't convert, pandas is more lenient
+    if chunk is None:
+        chunk = read_range_pandas(raw, name)
+    return dtl_data.compact_chunk(chunk, dtl_data.SCHEMAS[name], areas)
+
+# Parsing the whole file with `workers` workers, returns the frame and the source fingerprint.
+# Ranges are small enough for `workers` of them to be parsed at once within the memory budget,
+# and no more than that are in flight (or held as parsed results) at any time.
+def parse_parallel(name, path, workers = None, areas = None, budget = dtl_data.INGEST_BUDGET, executor = "process"):
+    workers = workers or os.cpu_count() or 1
+    range_bytes = budget / (workers * dtl_data.PARSE_OVERHEAD)
+    count = max(workers * RANGES_PER_WORKER, int(np.ceil(os.path.getsize(path) / range_bytes)))
+    header, ranges = row_ranges(path, count)
+    output = dtl_data.ChunkedFrame(dtl_data.SCHEMAS[name])
+    ranges = iter(ranges)
+    with EXECUTORS[executor](max_workers = workers) as pool:
+        # at most `workers` ranges in flight, the next one submitted as the oldest is appended (in file order)
+        futures = collections.deque(pool.submit(parse_range, path, header, start, stop, name, areas)
+                                    for start, stop in itertools.islice(ranges, workers))
+        sha256 = dtl_data.file_sha256(path)  # while the workers parse
+        while futures:
+            output.append(futures.popleft().result())
+            following = next(ranges, None)
+            if following is not None:
+                futures.append(pool.submit(parse_range, path, header, *following, name, areas))
+    return output.to_frame(), dtl_data.source_fingerprint(path, sha256, os.path.getsize(path))
@@ -0,0 +1,146 @@
+"""Project dimension: the building of every contract, resolved once at load.
+
+The contracts name their building in `project`, the projects file in
+`project_name`, and the two don't always agree on case, spacing or punctuation
+("MARINA HEIGHTS", "Marina Heights ", "Marina-Heights"). Names are normalized on
+both sides and every distinct contract project is matched to a project record
+once, by category, not contract by contract.
+
+Each project record is kept preformatted for the building panel (dates as
+text, total units as a whole number, None when missing), so a lookup is one dict
+access. The join coverage (how many contracts got their building, exactly or
+through the normalized name, and which names didn't) is counted on the way.
+"""
+import copy
+import sys
+
+import numpy as np
+import pandas as pd
+
+import dtl_data
+
+TOP_UNMATCHED = 10
+
+
+# Case, Unicode width variants, punctuation and spacing don't tell buildings apart: "Al Sahab - 2" and
+# "AL SAHAB 2" are the same key. Missing names stay None.
+def normalize_names(names):
+    names = pd.Series(np.asarray(names, dtype = object))
+    keys = (names.astype(str).str.normalize('NFKC').str.casefold()
+            .str.replace('&', ' and ', regex = False)
+            .str.replace(r'[\W_]+', ' ', regex = True)
+            .str.strip())
+    return np.where(names.isna() | (keys == ''), None, keys.to_numpy(dtype = object))
+
+def format_dates(days):
+    dates = pd.Series(dtl_data.decode_dates(days)).dt.strftime('%d %b %Y')
+    return dates.where(dates.notna(), None).to_numpy(dtype = object)
+
+def to_objects(values):
+    values = pd.Series(np.asarray(values, dtype = object))
+    return values.where(values.notna(), None).to_numpy(dtype = object)
+
+
+class ProjectDimension:
+    """Preformatted project records by normalized name, and the record of every contract project."""
+
+    def __init__(self, projects, data):
+        names = to_objects(projects['project_name'])
+        keys = normalize_names(names)
+        units = projects['total_units'].to_numpy(dtype = 'float64')
+        lat = projects['lat'].to_numpy(dtype = 'float64')
+        long = projects['long'].to_numpy(dtype = 'float64')
+        columns = {
+            "project_name": names,
+            "developer_name": to_objects(projects['developer_name']),
+            "start_date": format_dates(projects['start_date']),
+            "completion_date": format_dates(projects['completion_date']),
+            "area": to_objects(projects['area']),
+            "total_units": np.where(np.isnan(units), None, np.nan_to_num(units).astype('int64').astype(str)),
+            "lat": np.where(np.isnan(lat), None, lat.astype(str)),
+            "long": np.where(np.isnan(long), None, long.astype(str)),
+        }
+
+        # the first record of a name wins, as the projects scan used to pick the first match
+        self.records = {}
+        self.locations = {}
+        self.duplicates = 0
+        for i, key in enumerate(keys):
+            if key is None:
+                continue
+            if key in self.records:
+                self.duplicates += 1
+                continue
+            self.records[key] = {column: values[i] for column, values in columns.items()}
+            self.locations[key] = (lat[i], long[i])
+        self.names = set(name for name in names if name is not None)
+
+        self.resolved = {}  # contract project -> record key, None when it has no record
+        self.contracts = {}  # record key -> the contract projects resolved to it
+        self.update(data)
+
+    # Resolving the contract projects not seen yet (all of them at load, the new ones after an
+    # ingest) and counting the join coverage over all contracts again
+    def update(self, data):
+        projects = data['project'].array
+        categories = np.asarray(projects.categories, dtype = object)
+        new = [name for name in categories if name not in self.resolved]
+        for name, key in zip(new, normalize_names(new)):
+            key = key if key in self.records else None
+            self.resolved[name] = key
+            if key is not None:
+                self.contracts.setdefault(key, []).append(name)
+
+        codes = np.asarray(projects.codes)
+        contracts = np.bincount(codes[codes >= 0], minlength = len(categories))
+        self.coverage = self.join_coverage(categories, contracts, len(codes))
+
+    # A copy to build the next version of the dataset on, the records are shared
+    def copy(self):
+        dimension = copy.copy(self)
+        dimension.resolved = dict(self.resolved)
+        dimension.contracts = {key: list(names) for key, names in self.contracts.items()}
+        return dimension
+
+    def join_coverage(self, categories, contracts, rows):
+        exact = np.array([name in self.names for name in categories], dtype = bool)
+        matched = np.array([self.resolved[name] is not None for name in categories], dtype = bool)
+        unmatched = pd.Series(contracts[~matched], index = categories[~matched]).sort_values(ascending = False)
+        with_project = int(contracts.sum())
+        return {
+            "contracts": rows,
+            "without_project": rows - with_project,
+            "exact": int(contracts[exact].sum()),
+            "normalized": int(contracts[matched & ~exact].sum()),
+            "unmatched": int(contracts[~matched].sum()),
+            "coverage": float(contracts[matched].sum() / with_project) if with_project else np.nan,
+            "projects": len(self.records),
+            "duplicate_projects": self.duplicates,
+            "projects_without_contracts": len(self.records) - len(self.contracts),
+            "top_unmatched": {name: int(count) for name, count in unmatched.head(TOP_UNMATCHED).items() if count},
+        }
+
+    def key(self, project):
+        key = self.resolved.get(project)
+        if key is None and project not in self.resolved:
+            key = normalize_names([project])[0]  # a name no contract has (yet)
+            key = key if key in self.records else None
+        return key
+
+    # The preformatted record of a contract project, None when the projects file doesn't have it
+    def get(self, project):
+        key = self.key(project)
+        return None if key is None else self.records[key]
+
+    def location(self, project):
+        key = self.key(project)
+        return None if key is None else self.locations[key]
+
+    # The contract projects of a project record, by its project_name
+    def contract_projects(self, project_name):
+        return self.contracts.get(self.key(project_name), [])
+
+    @property
+    def nbytes(self):
+        return (sum(sys.getsizeof(record) for record in self.records.values())
+                + sys.getsizeof(self.records) + sys.getsizeof(self.locations) + sys.getsizeof(self.resolved))
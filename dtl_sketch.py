@@ -0,0 +1,155 @@
+"""Mergeable quantile sketches of annual_amount, for the "fair price" percentile.
+
+Every segment (project, usage, property size band) keeps a log-bucket histogram
+of its annual amounts (the DDSketch layout): bucket b holds the amounts in
+(GAMMA**(b-1), GAMMA**b], so any quantile read from it is within RELATIVE_ACCURACY
+of the exact one. Two sketches merge by adding their bucket counts, which is what
+makes them cheap to combine across buildings or areas on demand, to build for
+every segment at once with one groupby, and to update when contracts are added
+(or subtracted when they are amended).
+"""
+import copy
+
+import numpy as np
+import pandas as pd
+
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+ZERO_BUCKET = -1  # amounts below 1 AED, read back as 0
+SIZE_BAND = 20  # sq.m
+
+
+def bucket_of(amounts):
+    amounts = np.asarray(amounts, dtype = 'float64')
+    buckets = np.ceil(np.log(np.maximum(amounts, 1)) / np.log(GAMMA))
+    return np.where(amounts >= 1, buckets, ZERO_BUCKET).astype(np.int16)
+
+# The amount a bucket stands for, the point of (GAMMA**(b-1), GAMMA**b] with the smallest relative error
+def bucket_value(buckets):
+    buckets = np.asarray(buckets, dtype = 'float64')
+    return np.where(buckets == ZERO_BUCKET, 0.0, 2 * GAMMA ** buckets / (GAMMA + 1))
+
+# Lower bound of the property size band, -1 for a missing size
+def size_band(sizes):
+    sizes = np.asarray(sizes, dtype = 'float64')
+    return np.where(np.isnan(sizes), -1, np.floor(np.nan_to_num(sizes) / SIZE_BAND) * SIZE_BAND).astype(np.int32)
+
+
+class QuantileSketch:
+    """Bucket counts of one segment (or of several merged), sorted by bucket."""
+
+    def __init__(self, buckets, counts):
+        self.buckets = np.asarray(buckets, dtype = np.int16)
+        self.counts = np.asarray(counts, dtype = np.int64)
+        self.cumulative = np.cumsum(self.counts)
+
+    @property
+    def count(self):
+        return int(self.cumulative[-1]) if len(self.cumulative) else 0
+
+    # Adding (or with sign = -1, taking away) the bucket counts of other sketches
+    def merge(self, *others, sign = 1):
+        buckets = np.concatenate([self.buckets] + [other.buckets for other in others])
+        counts = np.concatenate([self.counts] + [sign * other.counts for other in others])
+        return QuantileSketch(*sum_buckets(buckets, counts))
+
+    # Amount at quantile q (0..1), within RELATIVE_ACCURACY of the exact one
+    def quantile(self, q):
+        if self.count == 0:
+            return np.nan
+        rank = q * (self.count - 1)
+        return float(bucket_value(self.buckets[np.searchsorted(self.cumulative, rank, side = 'right')]))
+
+    # Share of the amounts below `amount` (half of those in its own bucket), 0..1
+    def percentile(self, amount):
+        if self.count == 0:
+            return np.nan
+        bucket = bucket_of([amount])[0]
+        at = np.searchsorted(self.buckets, bucket)
+        below = self.cumulative[at - 1] if at > 0 else 0
+        same = self.counts[at] if at < len(self.buckets) and self.buckets[at] == bucket else 0
+        return float((below + same / 2) / self.count)
+
+# Summing the counts of equal buckets, empty buckets dropped
+def sum_buckets(buckets, counts):
+    unique, inverse = np.unique(buckets, return_inverse = True)
+    sums = np.bincount(inverse, weights = counts, minlength = len(unique)).astype(np.int64)
+    keep = sums != 0
+    return unique[keep], sums[keep]
+
+
+class SegmentSketches:
+    """One QuantileSketch per (project, usage, size band), plus the size bands of each building
+    and the projects of each area, to merge them by building or by area."""
+
+    def __init__(self, data):
+        self.sketches = {}
+        self.bands = {}
+        self.areas = {}
+        self.add(data)
+
+    # Bucket counts of the contracts of `frame`, by segment
+    @staticmethod
+    def segment_counts(frame):
+        project_codes, project_names = pd.factorize(frame['project'])
+        usage_codes, usage_names = pd.factorize(frame['usage'])
+        project_names, usage_names = np.asarray(project_names, dtype = object), np.asarray(usage_names, dtype = object)
+        counts = pd.DataFrame({
+            'project': project_codes,
+            'usage': usage_codes,
+            'band': size_band(frame['property_size']),
+            'bucket': bucket_of(frame['annual_amount']),
+        })
+        counts = counts[(counts['project'] >= 0) & (counts['usage'] >= 0) & (counts['band'] >= 0)]
+        counts = counts.groupby(['project', 'usage', 'band', 'bucket'], sort = True).size().reset_index()
+        project, usage, band, buckets, values = (counts[column].to_numpy() for column in counts.columns)
+
+        changes = np.flatnonzero((project[1:] != project[:-1]) | (usage[1:] != usage[:-1]) | (band[1:] != band[:-1])) + 1
+        for start, stop in zip(np.concatenate(([0], changes)), np.concatenate((changes, [len(values)]))):
+            if start == stop:
+                continue
+            key = (project_names[project[start]], usage_names[usage[start]], int(band[start]))
+            yield key, buckets[start:stop], values[start:stop]
+
+    # Counting more contracts in (sign = -1: counting superseded ones out)
+    def add(self, frame, sign = 1):
+        for key, buckets, counts in self.segment_counts(frame):
+            sketch = QuantileSketch(buckets, counts)
+            if key in self.sketches:
+                sketch = self.sketches[key].merge(sketch, sign = sign)
+            self.sketches[key] = sketch
+            self.bands.setdefault(key[:2], set()).add(key[2])
+        if sign > 0:
+            located = pd.DataFrame({'area': np.asarray(frame['area']), 'project': np.asarray(frame['project'])})
+            for area, project in located.dropna().drop_duplicates().itertuples(index = False):
+                self.areas.setdefault(area, set()).add(project)
+
+    # A copy to build the next version of the dataset on, the sketches themselves are never modified
+    def copy(self):
+        sketches = copy.copy(self)
+        sketches.sketches = dict(self.sketches)
+        sketches.bands = {key: set(bands) for key, bands in self.bands.items()}
+        sketches.areas = {area: set(projects) for area, projects in self.areas.items()}
+        return sketches
+
+    def subtract(self, frame):
+        self.add(frame, sign = -1)
+
+    def segment(self, project, usage, size):
+        return self.sketches.get((project, usage, int(size_band([size])[0])))
+
+    # One sketch from the segments of the given projects (all size bands when size is None)
+    def merged(self, projects, usage, size = None):
+        band = None if size is None else int(size_band([size])[0])
+        parts = []
+        for project in projects:
+            bands = self.bands.get((project, usage), ())
+            parts.extend(self.sketches[(project, usage, b)] for b in bands if band is None or b == band)
+        return QuantileSketch([], []).merge(*parts)
+
+    def area_projects(self, area):
+        return self.areas.get(area, set())
+
+    @property
+    def nbytes(self):
+        return sum(s.buckets.nbytes + s.counts.nbytes + s.cumulative.nbytes for s in self.sketches.values())
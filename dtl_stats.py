@@ -0,0 +1,138 @@
+"""Precomputed statistics over the rent contracts table.
+
+The building charts are drawn from these few aggregated rows instead of handing
+every raw contract of the building to Altair, and the rent index is a lookup in
+a table of monthly/quarterly medians instead of a groupby on every rerun.
+"""
+import copy
+
+import numpy as np
+import pandas as pd
+
+import dtl_data
+
+BUILDING_KEYS = ['project', 'usage']
+CUBE_KEYS = BUILDING_KEYS + ['property_size']
+QUANTILES = {'q25_amount': 0.25, 'q75_amount': 0.75}
+INDEX_LEVELS = {'building': ['project', 'usage'], 'area': ['area', 'usage']}
+INDEX_PERIODS = {'month': 1, 'quarter': 3}
+
+
+# count, mean, median and quartiles of annual_amount for each group of `keys`
+def aggregate_amounts(data, keys):
+    grouped = data.groupby(keys, observed = True, sort = True)['annual_amount']
+    table = grouped.agg(contracts = 'count', mean_amount = 'mean', median_amount = 'median')
+    quantiles = grouped.quantile(list(QUANTILES.values())).unstack()
+    for column, q in QUANTILES.items():
+        table[column] = quantiles[q]
+    return table
+
+# Swapping the rows of the given (project, usage) groups for freshly computed ones
+def replace_groups(table, fresh, buildings):
+    building = pd.MultiIndex.from_arrays([table.index.get_level_values(key) for key in BUILDING_KEYS])
+    return pd.concat([table[~building.isin(list(buildings))], fresh]).sort_index()
+
+
+class BuildingCube:
+    """Aggregated annual_amount by (project, usage, property_size) and by (project, usage)."""
+
+    def __init__(self, data):
+        self.sizes = aggregate_amounts(data, CUBE_KEYS)
+        self.totals = aggregate_amounts(data, BUILDING_KEYS)
+
+    # Recomputing only the (project, usage) groups that changed (incremental ingest),
+    # from their current rows in the index
+    def update(self, data, index, buildings):
+        if not buildings:
+            return
+        rows = np.concatenate([index.building_rows(project, usage) for project, usage in buildings])
+        subset = pd.DataFrame({column: data[column].array.take(rows) for column in CUBE_KEYS + ['annual_amount']})
+        self.sizes = replace_groups(self.sizes, aggregate_amounts(subset, CUBE_KEYS), buildings)
+        self.totals = replace_groups(self.totals, aggregate_amounts(subset, BUILDING_KEYS), buildings)
+
+    # A copy to build the next version of the dataset on, update() replaces the frames
+    def copy(self):
+        return copy.copy(self)
+
+    # One row per property size of the building, ready to be charted
+    def building_sizes(self, project, usage):
+        try:
+            rows = self.sizes.loc[(project, usage)].reset_index()
+        except KeyError:
+            rows = self.sizes.iloc[0:0].reset_index(BUILDING_KEYS, drop = True).reset_index()
+        rows['property_size'] = dtl_data.decode_sizes(rows['property_size'])
+        return rows
+
+    def building_totals(self, project, usage):
+        try:
+            return self.totals.loc[(project, usage)]
+        except KeyError:
+            return None
+
+
+# Months since 1970-01 of the first month of the period each start_date falls in, -1 when missing
+def period_of(start_days, months = 1):
+    start_days = np.asarray(start_days)
+    month = start_days.astype('int64').astype('datetime64[D]').astype('datetime64[M]').astype('int64')
+    return np.where(start_days == dtl_data.DAY_NA, -1, month // months * months).astype(np.int32)
+
+def period_dates(periods):
+    return np.asarray(periods, dtype = 'int64').astype('datetime64[M]').astype('datetime64[ns]')
+
+# Median annual_amount and number of contracts for each group of `keys` and period
+def median_table(data, keys, months):
+    frame = pd.DataFrame({key: data[key].array for key in keys})
+    frame['period'] = period_of(data['start_date'].to_numpy(), months)
+    frame['annual_amount'] = data['annual_amount'].to_numpy()
+    frame = frame[frame['period'].to_numpy() >= 0]
+    grouped = frame.groupby(keys + ['period'], observed = True, sort = True)['annual_amount']
+    return grouped.agg(median_amount = 'median', contracts = 'count').astype({'median_amount': 'float32', 'contracts': 'int32'})
+
+
+class RentIndex:
+    """Median annual_amount by month and by quarter, per building (project, usage) and per (area, usage)."""
+
+    def __init__(self, data):
+        self.tables = {(level, period): median_table(data, keys, months)
+                       for level, keys in INDEX_LEVELS.items()
+                       for period, months in INDEX_PERIODS.items()}
+
+    # Recomputing every period from the first one the `changed` rows fall in (incremental ingest),
+    # new contracts are recent so that's a few periods only. `live` are the positions of the rows
+    # still in use, superseded ones left out.
+    def update(self, data, live, changed):
+        start_date = data['start_date'].to_numpy()
+        changed_days = start_date[changed]
+        changed_days = changed_days[changed_days != dtl_data.DAY_NA]
+        if len(changed_days) == 0:
+            return
+
+        for period, months in INDEX_PERIODS.items():
+            first = period_of([changed_days.min()], months)[0]
+            rows = live[period_of(start_date[live], months) >= first]
+            recent = pd.DataFrame({column: data[column].array.take(rows)
+                                   for column in ['project', 'usage', 'area', 'start_date', 'annual_amount']})
+            for level, keys in INDEX_LEVELS.items():
+                table = self.tables[(level, period)]
+                kept = table[table.index.get_level_values('period') < first]
+                self.tables[(level, period)] = pd.concat([kept, median_table(recent, keys, months)]).sort_index()
+
+    # A copy to build the next version of the dataset on, update() replaces the tables
+    def copy(self):
+        rent_index = copy.copy(self)
+        rent_index.tables = dict(self.tables)
+        return rent_index
+
+    # One row per period of the building or the area, with its start date
+    def series(self, level, key, usage, period = 'month'):
+        table = self.tables[(level, period)]
+        try:
+            rows = table.loc[(key, usage)].reset_index()
+        except KeyError:
+            rows = table.iloc[0:0].reset_index(INDEX_LEVELS[level], drop = True).reset_index()
+        rows.insert(0, 'date', period_dates(rows['period']))
+        return rows.drop(columns = 'period')
+
+    @property
+    def nbytes(self):
+        return sum(int(table.memory_usage(index = True, deep = True).sum()) for table in self.tables.values())
@@ -0,0 +1,113 @@
+"""Timing of the app's hot path, rerun by rerun.
+
+Each stage of a rerun (data load, ECN check, ECN filter, project join, every
+chart and the map) runs inside a span. The tracer keeps the latest span timings
+and cache hit/miss counters for the whole server process, summarizes them as
+p50/p95 latencies and exports them as JSON lines. When it's disabled a span is
+a shared no-op context manager, nothing is timed or stored.
+"""
+import collections
+import contextlib
+import itertools
+import json
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+NO_SPAN = contextlib.nullcontext()
+MAX_EVENTS = 10_000
+
+
+class Tracer:
+    """Span timings and cache counters shared by every session of the server process."""
+
+    def __init__(self, enabled = False, max_events = MAX_EVENTS):
+        self.enabled = enabled
+        self.events = collections.deque(maxlen = max_events)  # the oldest timings go first
+        self.calls = collections.Counter()
+        self.misses = collections.Counter()
+        self.reruns = itertools.count(1)
+        self.lock = threading.Lock()
+        self.local = threading.local()  # every session runs its reruns in its own thread
+
+    # Numbering the spans of a new rerun of this session
+    def begin_rerun(self):
+        if self.enabled:
+            self.local.rerun = next(self.reruns)
+            self.local.started = time.perf_counter()
+
+    # The whole rerun as one more span
+    def end_rerun(self):
+        if self.enabled and hasattr(self.local, "started"):
+            self.record("rerun", time.perf_counter() - self.local.started)
+
+    def span(self, name):
+        if not self.enabled:
+            return NO_SPAN
+        return self.timed(name)
+
+    @contextlib.contextmanager
+    def timed(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name, seconds):
+        self.events.append({"rerun": getattr(self.local, "rerun", None), "span": name, "seconds": seconds, "at": time.time()})
+
+    # Calling a cached function (st.cache_resource/st.cache_data) inside a span. The function
+    # itself calls `miss(name)` when it actually runs, every other call was a cache hit.
+    def cached(self, name, function, *args):
+        if not self.enabled:
+            return function(*args)
+        with self.lock:
+            self.calls[name] += 1
+        with self.span(name):
+            return function(*args)
+
+    def miss(self, name):
+        if self.enabled:
+            with self.lock:
+                self.misses[name] += 1
+
+    # Calls, p50 and p95 of every span, in milliseconds
+    def summary(self):
+        events = pd.DataFrame(list(self.events), columns = ["rerun", "span", "seconds", "at"])
+        grouped = events.groupby("span", sort = False)["seconds"]
+        return pd.DataFrame({
+            "calls": grouped.count(),
+            "p50_ms": grouped.quantile(0.5) * 1000,
+            "p95_ms": grouped.quantile(0.95) * 1000,
+            "max_ms": grouped.max() * 1000,
+        })
+
+    # Hits, misses and hit rate of every cached function
+    def cache_counters(self):
+        with self.lock:
+            calls, misses = dict(self.calls), dict(self.misses)
+        counters = {}
+        for name in calls.keys() | misses.keys():
+            hits = max(calls.get(name, 0) - misses.get(name, 0), 0)
+            total = hits + misses.get(name, 0)
+            counters[name] = {"hits": hits, "misses": misses.get(name, 0), "hit_rate": hits / total if total else np.nan}
+        return counters
+
+    # One JSON line per span timing, then one per cache counter
+    def json_lines(self):
+        lines = [json.dumps(event) for event in list(self.events)]
+        lines += [json.dumps({"cache": name, **counter}) for name, counter in self.cache_counters().items()]
+        return "\n".join(lines) + "\n"
+
+    def export(self, path):
+        with open(path, "a") as f:
+            f.write(self.json_lines())
+
+    def reset(self):
+        self.events.clear()
+        with self.lock:
+            self.calls.clear()
+            self.misses.clear()
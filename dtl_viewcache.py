@@ -0,0 +1,138 @@
+"""View models and chart specs of the page, cached across reruns and sessions.
+
+Streamlit reruns the whole script on every widget interaction, and each rerun
+used to look the ECN up again and rebuild every chart. A view model holds what
+the page shows for one ECN (its contract rows, the property overview, the rent
+history), built once. Chart specs are cached on their own, keyed by what they
+depend on: the building charts by (project, usage, size), so every tenant of a
+tower with the same kind of unit gets the same specs.
+
+Both caches are LRU, bounded by their number of entries and their (approximate)
+size, count their hits, misses and evictions, and start over whenever the
+dataset version changes (a rebuilt snapshot or an ingested delta). Cached values
+are shared by every session, they must never be modified in place.
+"""
+import collections
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+
+import dtl_engine
+
+MAX_VIEWS = 2_000
+MAX_VIEW_BYTES = 64 * 2**20
+MAX_CHARTS = 2_000
+MAX_CHART_BYTES = 128 * 2**20
+
+
+# Approximate memory of a cached value: frames and arrays by their buffers, containers by their items
+def value_bytes(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index = True, deep = True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index = True, deep = True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(value_bytes(k) + value_bytes(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(value_bytes(v) for v in value)
+    if hasattr(value, "to_json"):  # a pydeck Deck, sent as JSON
+        return len(value.to_json())
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """Values by key, least recently used first out, for a single version of the dataset."""
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()  # key -> (value, bytes), oldest first
+        self.nbytes = 0
+        self.version = None
+        self.hits = self.misses = self.evictions = 0
+        self.lock = threading.Lock()
+
+    # The cached value of `key`, or the one `build()` returns, cached on the way.
+    # Built outside the lock: two sessions may build the same value at once, both get one.
+    # A newer version empties the cache, a session still on an older one gets its value uncached.
+    def get(self, key, build, version):
+        with self.lock:
+            if self.version is None or version > self.version:
+                self._clear()
+                self.version = version
+            if version == self.version and key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+
+        value = build()
+        nbytes = value_bytes(value)
+        with self.lock:
+            if version == self.version and nbytes <= self.max_bytes:
+                if key in self.entries:
+                    self.nbytes -= self.entries.pop(key)[1]
+                self.entries[key] = (value, nbytes)
+                self.nbytes += nbytes
+                while len(self.entries) > self.max_entries or self.nbytes > self.max_bytes:
+                    self.nbytes -= self.entries.popitem(last = False)[1][1]
+                    self.evictions += 1
+        return value
+
+    def _clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def clear(self):
+        with self.lock:
+            self._clear()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.nbytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else np.nan,
+            }
+
+
+# Everything the page shows for an ECN that doesn't depend on a widget
+def build_view(dataset, ecn):
+    contracts = dtl_engine.contract_rows(dataset, ecn).reset_index(drop = True)
+    overview = dtl_engine.property_overview(contracts)
+    return {
+        "contracts": contracts,
+        "property": overview,
+        "history": dtl_engine.rent_history(dataset, overview['pid']),
+    }
+
+
+class ViewCache:
+    """Per-ECN view models and shared chart specs, both invalidated by the dataset version."""
+
+    def __init__(self, max_views = MAX_VIEWS, max_view_bytes = MAX_VIEW_BYTES,
+                 max_charts = MAX_CHARTS, max_chart_bytes = MAX_CHART_BYTES):
+        self.views = LRUCache(max_views, max_view_bytes)
+        self.charts = LRUCache(max_charts, max_chart_bytes)
+
+    def view(self, dataset, ecn):
+        return self.views.get(str(ecn), lambda: build_view(dataset, ecn), dataset.version)
+
+    # A chart spec (or any other rendered object) by key, e.g. ("building_size", project, usage, size)
+    def chart(self, dataset, key, build):
+        return self.charts.get(key, build, dataset.version)
+
+    def stats(self):
+        return {"views": self.views.stats(), "charts": self.charts.stats()}
+
+    def clear(self):
+        self.views.clear()
+        self.charts.clear()
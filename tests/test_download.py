@@ -0,0 +1,116 @@
+"""The download cache against a stand-in HTTP server on localhost."""
+import http.client
+import http.server
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dtl_download
+
+BODY = b"ecn,pid\n" + b"".join(b"%d,%d\n" % (10**14 + i, i) for i in range(20_000))
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """Serves `server.body` with `server.etag` (when set), honouring If-None-Match and Range/If-Range.
+    `server.drop_after` bytes into the next response, the connection is dropped."""
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        if server.etag and self.headers.get("If-None-Match") == server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        start = 0
+        if "Range" in self.headers and server.etag and self.headers.get("If-Range") == server.etag:
+            start = int(self.headers["Range"].removeprefix("bytes=").rstrip("-"))
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(server.body) - 1}/{len(server.body)}")
+        else:
+            self.send_response(200)
+        if server.etag:
+            self.send_header("ETag", server.etag)
+        self.send_header("Content-Length", str(len(server.body) - start))
+        self.end_headers()
+        body = server.body[start:]
+        if server.drop_after is not None:
+            body, server.drop_after = body[:server.drop_after], None
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    for proxy in ("http_proxy", "HTTP_PROXY", "all_proxy", "ALL_PROXY"):
+        monkeypatch.delenv(proxy, raising = False)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.body, server.etag, server.drop_after, server.requests = BODY, '"v1"', None, []
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/data.csv"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def cache(tmp_path):
+    return dtl_download.DownloadCache(str(tmp_path / "downloads"), timeout = 10)
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_revalidation_not_modified(server, cache):
+    path = cache.fetch(server.url)
+    assert read(path) == BODY
+    assert cache.meta(server.url)["etag"] == '"v1"'
+
+    assert cache.download(server.url) is False
+    assert server.requests[-1]["If-None-Match"] == '"v1"'
+    assert read(path) == BODY
+
+def test_dropped_transfer_resumed(server, cache):
+    server.drop_after = len(BODY) // 3
+    with pytest.raises(http.client.IncompleteRead):
+        cache.fetch(server.url)
+    _, _, part_path = cache.paths(server.url)
+    assert os.path.getsize(part_path) == len(BODY) // 3
+    assert cache.meta(server.url) is None
+
+    path = cache.fetch(server.url)
+    assert server.requests[-1]["Range"] == f"bytes={len(BODY) // 3}-"
+    assert server.requests[-1]["If-Range"] == '"v1"'
+    assert read(path) == BODY
+    assert not os.path.exists(part_path)
+
+def test_no_validators_unchanged_keeps_file(server, cache):
+    server.etag = None
+    path = cache.fetch(server.url)
+    os.utime(path, (1_000_000_000, 1_000_000_000))
+
+    assert cache.download(server.url) is False  # downloaded again, same hash
+    assert "If-None-Match" not in server.requests[-1]
+    assert os.path.getmtime(path) == 1_000_000_000
+
+    server.body = BODY + b"1,2\n"
+    assert cache.download(server.url) is True
+    assert read(path) == server.body
+
+def test_background_refresh_calls_on_change(server, cache):
+    cache.fetch(server.url)
+    server.body, server.etag = BODY + b"1,2\n", '"v2"'
+    changed = []
+
+    path = cache.local(server.url, changed.append)  # the last good copy, straight away
+    cache.refreshes[server.url].join(timeout = 10)
+    assert changed == [path]
+    assert read(path) == server.body
+    assert cache.status(server.url)["refreshing"] is False
@@ -0,0 +1,40 @@
+"""Lookups of the engine over a small dataset built in memory."""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dtl_data
+import dtl_dataset
+import dtl_engine
+from test_ingest import contracts
+
+
+def csv_bytes(frame):
+    return frame.to_csv(index = False).encode()
+
+def test_comparable_rents_counts_each_building_once():
+    rng = np.random.default_rng(11)
+    data = contracts(rng, 60, np.arange(60) % 3, '2021-01-01')  # Tower 0, 1 and 2
+    data['property_size'] = 100.0
+    # "Tower 1" twice in the projects file, and "TOWER 1" normalized to the same record
+    projects = pd.DataFrame({
+        'project_name': ['Tower 0', 'Tower 1', 'TOWER 1', 'Tower 1', 'Tower 2'],
+        'developer_name': 'Emaar',
+        'start_date': '2005-01-01',
+        'completion_date': '2008-01-01',
+        'area': 'Marsa Dubai',
+        'total_units': 100.0,
+        'lat': [25.080, 25.081, 25.0811, 25.082, 25.083],
+        'long': [55.130, 55.131, 55.1311, 55.132, 55.133],
+    })
+    dataset = dtl_dataset.Dataset(dtl_data.parse_data_csv(csv_bytes(data)), dtl_data.parse_projects_csv(csv_bytes(projects)))
+
+    buildings, median, mean = dtl_engine.comparable_rents(dataset, 'Tower 1', 'Residential', 100)
+    assert list(buildings['project']) == ['Tower 1', 'Tower 0', 'Tower 2']
+    assert list(buildings['contracts']) == [20, 20, 20]
+    amounts = data['annual_amount'].to_numpy()
+    assert (median, mean) == (np.median(amounts), np.mean(amounts))
@@ -0,0 +1,188 @@
+"""Incremental ingest against a dataset built from scratch out of the same contracts."""
+import os
+import shutil
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dtl_data
+import dtl_dataset
+
+PROJECTS = [f"Tower {i}" for i in range(6)]
+
+
+def contracts(rng, n, pids, registered):
+    registration = pd.to_datetime(registered) + pd.to_timedelta(rng.integers(0, 300, n), unit = 'D')
+    start = registration + pd.Timedelta(days = 5)
+    sizes = np.round(rng.uniform(40, 200, n), 2)
+    amounts = rng.integers(40_000, 250_000, n)
+    return pd.DataFrame({
+        'ecn': rng.integers(10**14, 10**15, n),
+        'pid': pids,
+        'registration_date': registration.strftime('%Y-%m-%d'),
+        'start_date': start.strftime('%Y-%m-%d'),
+        'end_date': (start + pd.Timedelta(days = 364)).strftime('%Y-%m-%d'),
+        'version': rng.choice(['New', 'Renewed'], n),
+        'area': 'Marsa Dubai',
+        'contract_amount': amounts,
+        'annual_amount': amounts,
+        'property_type': 'Unit',
+        'property_subtype': 'Flat',
+        'property_size': sizes,
+        'usage': 'Residential',
+        'nearest_metro': 'DMCC',
+        'nearest_mall': 'Marina Mall',
+        'project': np.asarray(PROJECTS)[np.asarray(pids) % len(PROJECTS)],
+    })
+
+
+@pytest.fixture
+def sources(tmp_path):
+    rng = np.random.default_rng(7)
+    base = contracts(rng, 400, rng.integers(0, 60, 400), '2020-01-01')
+    # registered after the watermark: late registrations starting years before the known contracts
+    # of their property, contracts of properties not seen yet, and ordinary new ones
+    late = contracts(rng, 30, rng.integers(0, 60, 30), '2021-06-01')
+    late['start_date'] = (pd.to_datetime(late['start_date']) - pd.DateOffset(years = 3)).dt.strftime('%Y-%m-%d')
+    unseen = contracts(rng, 20, rng.integers(60, 80, 20), '2021-06-01')
+    recent = contracts(rng, 20, rng.integers(0, 60, 20), '2021-06-01')
+    amended = base.sample(10, random_state = 3).copy()
+    amended['annual_amount'] += 1
+    amended['registration_date'] = '2022-06-01'
+    kept = base[~base['ecn'].isin(amended['ecn'])]
+    update = pd.concat([kept, late, unseen, recent, amended], ignore_index = True)
+
+    projects = pd.DataFrame({
+        'project_name': PROJECTS,
+        'developer_name': 'Emaar',
+        'start_date': '2005-01-01',
+        'completion_date': '2008-01-01',
+        'area': 'Marsa Dubai',
+        'total_units': 100.0,
+        'lat': 25.08 + np.arange(len(PROJECTS)) / 1000,
+        'long': 55.13 + np.arange(len(PROJECTS)) / 1000,
+    })
+    paths = {name: str(tmp_path / f"{name}.csv") for name in ("source", "base", "update", "projects")}
+    base.to_csv(paths["base"], index = False)
+    update.to_csv(paths["update"], index = False)
+    projects.to_csv(paths["projects"], index = False)
+    shutil.copy(paths["base"], paths["source"])
+    return paths, str(tmp_path / "snapshot")
+
+
+def by_ecn(dataset, ecn):
+    return dataset.rows(dataset.index.ecn_rows(ecn)).sort_values(['pid', 'version']).reset_index(drop = True)
+
+def rent_table(table):
+    table = table.reset_index()
+    for column in table.columns[:2]:
+        table[column] = table[column].astype(object)
+    return table.sort_values(list(table.columns[:3])).reset_index(drop = True)
+
+
+def test_ingest_matches_fresh_build(sources):
+    paths, snapshot_dir = sources
+    live = dtl_dataset.LiveDataset(dtl_dataset.Dataset.load(paths["source"], paths["projects"], snapshot_dir))
+    before = live.current
+    rows, version = len(before.data), before.version
+
+    shutil.copy(paths["update"], paths["source"])
+    assert live.ingest(paths["source"]) == (70, 10)
+    assert live.ingest(paths["source"]) == (0, 0)
+    dataset = live.current
+    # the sessions still on the previous dataset keep it as it was
+    assert (len(before.data), before.version) == (rows, version)
+    assert dataset.version > version
+
+    update = pd.read_csv(paths["update"])
+    with open(paths["update"], "rb") as f:
+        fresh = dtl_dataset.Dataset(dtl_data.parse_data_csv(f.read()), dataset.projects)
+
+    for ecn in update['ecn']:
+        pd.testing.assert_frame_equal(by_ecn(dataset, ecn), by_ecn(fresh, ecn), check_categorical = False)
+    start_date = dataset.data['start_date'].to_numpy()
+    fresh_start_date = fresh.data['start_date'].to_numpy()
+    for pid in update['pid'].unique():
+        # sorted by start_date, late registrations included
+        assert list(start_date[dataset.index.pid_rows(pid)]) == list(fresh_start_date[fresh.index.pid_rows(pid)])
+
+    for project in PROJECTS:
+        pd.testing.assert_frame_equal(dataset.cube.building_sizes(project, 'Residential'),
+                                      fresh.cube.building_sizes(project, 'Residential'), check_dtype = False)
+        for size in (50, 120, 190):
+            amounts = dataset.data['annual_amount'].to_numpy()[dataset.index.similar_rows(project, 'Residential', size)]
+            fresh_amounts = fresh.data['annual_amount'].to_numpy()[fresh.index.similar_rows(project, 'Residential', size)]
+            assert sorted(amounts) == sorted(fresh_amounts)
+
+    sketches = lambda d: {key: (list(s.buckets), list(s.counts)) for key, s in d.sketches.sketches.items() if s.count}
+    assert sketches(dataset) == sketches(fresh)
+    for key, table in dataset.rent_index.tables.items():
+        pd.testing.assert_frame_equal(rent_table(table), rent_table(fresh.rent_index.tables[key]))
+
+    # and the snapshot with its delta part reads back as the same contracts
+    reloaded = dtl_dataset.Dataset.load(paths["source"], paths["projects"], snapshot_dir)
+    order = ['ecn', 'version', 'pid']
+    pd.testing.assert_frame_equal(reloaded.data.sort_values(order).reset_index(drop = True),
+                                  fresh.data.sort_values(order).reset_index(drop = True), check_categorical = False)
+
+
+def test_integers_widen_beyond_int32(sources):
+    paths, snapshot_dir = sources
+    base = pd.read_csv(paths["base"])
+    live = dtl_dataset.LiveDataset(dtl_dataset.Dataset.load(paths["source"], paths["projects"], snapshot_dir))
+    assert live.current.data['annual_amount'].dtype == 'int32'
+
+    # a delta with amounts beyond int32 widens the column, in memory and in the snapshot
+    update = pd.concat([base, contracts(np.random.default_rng(1), 5, [1, 2, 3, 4, 5], '2021-06-01')], ignore_index = True)
+    update.loc[update.index[-5:], 'annual_amount'] = 3_000_000_000
+    update.to_csv(paths["source"], index = False)
+    assert live.ingest(paths["source"]) == (5, 0)
+    assert live.current.data['annual_amount'].dtype == 'int64'
+    assert dtl_data.read_manifest(snapshot_dir, "data")["schema"]["annual_amount"] == 'int64'
+    reloaded = dtl_dataset.Dataset.load(paths["source"], paths["projects"], snapshot_dir)
+    assert sorted(reloaded.data['annual_amount'])[-5:] == [3_000_000_000] * 5
+
+    # and a source with them from the start loads as int64, streamed or parsed in parallel
+    update.loc[update.index[:3], 'pid'] = 2**40
+    update.to_csv(paths["source"], index = False)
+    for workers in (None, 2):
+        data, _ = dtl_data.read_frame("data", paths["source"], workers = workers)
+        assert (data['pid'].dtype, data['annual_amount'].dtype, data['pid'].max()) == ('int64', 'int64', 2**40)
+    data = dtl_data.load_data(paths["source"], snapshot_dir)
+    assert dtl_data.read_manifest(snapshot_dir, "data")["schema"]["pid"] == 'int64'
+    assert data['pid'].max() == 2**40
+
+
+def test_contracts_without_version(sources):
+    paths, snapshot_dir = sources
+    rng = np.random.default_rng(5)
+    base = contracts(rng, 100, rng.integers(0, 30, 100), '2020-01-01')
+    base.loc[base.index[::4], 'version'] = None
+    base.to_csv(paths["source"], index = False)
+    live = dtl_dataset.LiveDataset(dtl_dataset.Dataset.load(paths["source"], paths["projects"], snapshot_dir))
+
+    # new contracts without a version are added once, not again by every ingest
+    more = contracts(rng, 10, rng.integers(0, 30, 10), '2021-06-01')
+    more.loc[more.index[::2], 'version'] = None
+    update = pd.concat([base, more], ignore_index = True)
+    update.to_csv(paths["source"], index = False)
+    assert live.ingest(paths["source"]) == (10, 0)
+    assert live.ingest(paths["source"]) == (0, 0)
+    assert len(live.current.data) == 110
+    assert len(dtl_dataset.Dataset.load(paths["source"], paths["projects"], snapshot_dir).data) == 110
+
+    # an amendment marks the snapshot as amended, the contracts without a version still read back
+    amended = update.iloc[[1]].copy()
+    amended['annual_amount'] += 1
+    amended['registration_date'] = '2022-06-01'
+    update = pd.concat([update.drop(update.index[1]), amended], ignore_index = True)
+    update.to_csv(paths["source"], index = False)
+    assert live.ingest(paths["source"]) == (0, 1)
+    assert dtl_data.read_manifest(snapshot_dir, "data")["amended"]
+    reloaded = dtl_dataset.Dataset.load(paths["source"], paths["projects"], snapshot_dir)
+    assert len(reloaded.data) == 110
+    assert reloaded.data['version'].isna().sum() == update['version'].isna().sum()
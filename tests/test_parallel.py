@@ -0,0 +1,44 @@
+"""The parallel CSV ingest against the streaming one, over the same files."""
+import codecs
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dtl_data
+import dtl_parallel
+from test_ingest import contracts
+
+AREAS = ['Marsa Dubai', 'Business Bay', 'Al Barsha First', 'Palm Jumeirah']
+
+
+@pytest.fixture
+def data_path(tmp_path):
+    rng = np.random.default_rng(3)
+    data = contracts(rng, 2_000, rng.integers(0, 300, 2_000), '2020-01-01')
+    data['area'] = rng.choice(AREAS, len(data))
+    data['nearest_metro'] = rng.choice([f"Metro {i}" for i in range(20)], len(data))
+    path = tmp_path / "data.csv"
+    data.to_csv(path, index = False)
+    return path
+
+def assert_same(path, areas, workers = 3):
+    streamed, _ = dtl_data.stream_csv("data", str(path), areas = areas)
+    parsed, _ = dtl_parallel.parse_parallel("data", str(path), workers, areas, budget = 2**20, executor = "thread")
+    pd.testing.assert_frame_equal(parsed, streamed)
+    return parsed
+
+@pytest.mark.parametrize("areas", [None, ['Marsa Dubai'], ['Business Bay', 'Palm Jumeirah']])
+def test_parallel_matches_stream(data_path, areas):
+    parsed = assert_same(data_path, areas)
+    if areas is not None:
+        assert sorted(parsed['area'].cat.categories) == sorted(areas)
+
+def test_parallel_reads_utf8_bom(data_path):
+    raw = data_path.read_bytes()
+    data_path.write_bytes(codecs.BOM_UTF8 + raw)
+    assert len(assert_same(data_path, None)) == 2_000